@@ -1,6 +1,8 @@
 import streamlit as st
 import logging
 from modules.ui import ui
+from modules.metrics import start_metrics_server
+from modules.scheduler import start_scheduler
 from datetime import datetime
 
 # Configure logging
@@ -12,6 +14,8 @@ logging.basicConfig(
 
 def main():
     logging.info(f"Starting CryptoTool app at {datetime.now()}")
+    start_metrics_server()
+    start_scheduler()
     
     # Khởi tạo session state
     if 'logged_in' not in st.session_state:
@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Optional
+import toml
+
+ALERTS_PATH = Path("config/alerts.toml")
+ALERT_KINDS = {
+    'price_above': ('price', 'up'),
+    'price_below': ('price', 'down'),
+    'rsi_above': ('rsi', 'up'),
+    'rsi_below': ('rsi', 'down'),
+    'fib_near': ('price', 'near')
+}
+DEFAULT_COOLDOWN = 300
+DEFAULT_TOLERANCE = 0.01
+
+
+class AlertEngine:
+    """So khớp giá/chỉ báo mới với các ngưỡng đã sắp xếp bằng bisect, chỉ báo các ngưỡng bị vượt qua."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alerts = {}
+        # (coin, field, direction, tolerance) -> ([ngưỡng đã sắp xếp], [id tương ứng])
+        self._index = {}
+        self._keys = {}
+        self._last_value = {}
+        self._last_fired = {}
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def add(self, coin: str, kind: str, threshold: float, cooldown: float = DEFAULT_COOLDOWN,
+            tolerance: float = DEFAULT_TOLERANCE, alert_id: Optional[str] = None, note: str = "") -> str:
+        """Đăng ký một cảnh báo, trả về id."""
+        if kind not in ALERT_KINDS:
+            raise ValueError(f"Loại cảnh báo không hợp lệ: {kind}")
+        field, direction = ALERT_KINDS[kind]
+        alert_id = alert_id or uuid.uuid4().hex[:8]
+        key = (coin, field, direction, tolerance if direction == 'near' else None)
+        with self._lock:
+            if alert_id in self._alerts:
+                self._remove_locked(alert_id)
+            self._alerts[alert_id] = {
+                'id': alert_id, 'coin': coin, 'kind': kind, 'threshold': float(threshold),
+                'cooldown': float(cooldown), 'tolerance': float(tolerance), 'note': note, 'key': key
+            }
+            if key not in self._index:
+                self._index[key] = ([], [])
+                self._keys.setdefault((coin, field), []).append(key)
+            thresholds, ids = self._index[key]
+            pos = bisect_right(thresholds, float(threshold))
+            thresholds.insert(pos, float(threshold))
+            ids.insert(pos, alert_id)
+        return alert_id
+
+    def _remove_locked(self, alert_id: str) -> None:
+        alert = self._alerts.pop(alert_id)
+        thresholds, ids = self._index[alert['key']]
+        pos = ids.index(alert_id)
+        del thresholds[pos]
+        del ids[pos]
+        self._last_fired.pop(alert_id, None)
+
+    def set_threshold(self, alert_id: str, threshold: float) -> bool:
+        """Đổi ngưỡng một cảnh báo tại chỗ (giữ cooldown đang chạy), True nếu ngưỡng thay đổi."""
+        threshold = float(threshold)
+        with self._lock:
+            alert = self._alerts.get(alert_id)
+            if alert is None or alert['threshold'] == threshold:
+                return False
+            thresholds, ids = self._index[alert['key']]
+            pos = ids.index(alert_id)
+            del thresholds[pos]
+            del ids[pos]
+            pos = bisect_right(thresholds, threshold)
+            thresholds.insert(pos, threshold)
+            ids.insert(pos, alert_id)
+            alert['threshold'] = threshold
+            return True
+
+    def remove(self, alert_id: str) -> bool:
+        """Xóa cảnh báo theo id."""
+        with self._lock:
+            if alert_id not in self._alerts:
+                return False
+            self._remove_locked(alert_id)
+            return True
+
+    def alerts(self) -> list:
+        """Danh sách cảnh báo (không kèm khóa chỉ mục nội bộ)."""
+        with self._lock:
+            return [{k: v for k, v in alert.items() if k != 'key'} for alert in self._alerts.values()]
+
+    def _crossed(self, key: tuple, prev: float, value: float) -> list:
+        thresholds, ids = self._index.get(key, ((), ()))
+        if not thresholds:
+            return []
+        direction = key[2]
+        if direction == 'up':
+            # prev < ngưỡng <= value
+            if value <= prev:
+                return []
+            return ids[bisect_right(thresholds, prev):bisect_right(thresholds, value)]
+        if direction == 'down':
+            # value <= ngưỡng < prev
+            if value >= prev:
+                return []
+            return ids[bisect_left(thresholds, value):bisect_left(thresholds, prev)]
+        # near: |value - level| / value < tolerance ⇔ level ∈ (value(1-tol), value(1+tol))
+        tol = key[3]
+        now_near = ids[bisect_right(thresholds, value * (1 - tol)):bisect_left(thresholds, value * (1 + tol))]
+        if prev is None or not now_near:
+            return now_near
+        prev_near = set(ids[bisect_right(thresholds, prev * (1 - tol)):bisect_left(thresholds, prev * (1 + tol))])
+        return [alert_id for alert_id in now_near if alert_id not in prev_near]
+
+    def update(self, coin: str, now: Optional[float] = None, **values) -> list:
+        """Đưa giá trị mới (price=..., rsi=...) vào, trả về các cảnh báo vừa kích hoạt."""
+        now = time.time() if now is None else now
+        fired = []
+        with self._lock:
+            for field, value in values.items():
+                if value is None:
+                    continue
+                value = float(value)
+                prev = self._last_value.get((coin, field))
+                self._last_value[(coin, field)] = value
+                for key in self._keys.get((coin, field), ()):
+                    if prev is None and key[2] != 'near':
+                        continue
+                    for alert_id in self._crossed(key, prev, value):
+                        alert = self._alerts[alert_id]
+                        if now - self._last_fired.get(alert_id, float('-inf')) < alert['cooldown']:
+                            continue
+                        self._last_fired[alert_id] = now
+                        fired.append({
+                            'id': alert_id, 'coin': coin, 'kind': alert['kind'],
+                            'threshold': alert['threshold'], 'value': value,
+                            'note': alert['note'], 'time': now
+                        })
+        return fired
+
+    def add_fib_alerts(self, coin: str, fib_levels: dict, cooldown: float = DEFAULT_COOLDOWN,
+                       tolerance: float = DEFAULT_TOLERANCE) -> list:
+        """Đăng ký cảnh báo fib_near cho từng mức Fibonacci (id cố định theo coin + mức)."""
+        return [
+            self.add(coin, 'fib_near', level_price, cooldown=cooldown, tolerance=tolerance,
+                     alert_id=f"{coin}_{level_name}", note=level_name)
+            for level_name, level_price in fib_levels.items()
+        ]
+
+    def refresh_fib_alerts(self, coin: str, fib_levels: dict) -> bool:
+        """Cập nhật ngưỡng các cảnh báo Fib đã bật của coin theo mức Fib vừa tính; True nếu có thay đổi."""
+        changed = False
+        for alert in self.alerts():
+            if alert['coin'] != coin or alert['kind'] != 'fib_near' or alert['note'] not in fib_levels:
+                continue
+            # Đổi ngưỡng tại chỗ để không reset cooldown của cảnh báo
+            changed = self.set_threshold(alert['id'], fib_levels[alert['note']]) or changed
+        return changed
+
+
+def load_alerts(engine: Optional[AlertEngine] = None) -> AlertEngine:
+    """Load cảnh báo từ alerts.toml vào engine."""
+    logging.info("Load alerts")
+    engine = engine or AlertEngine()
+    try:
+        if ALERTS_PATH.exists():
+            with open(ALERTS_PATH, "r") as f:
+                for item in toml.load(f).get("alerts", []):
+                    engine.add(
+                        item["coin"], item["kind"], item["threshold"],
+                        cooldown=item.get("cooldown", DEFAULT_COOLDOWN),
+                        tolerance=item.get("tolerance", DEFAULT_TOLERANCE),
+                        alert_id=item.get("id"), note=item.get("note", "")
+                    )
+        logging.info(f"Đã load {len(engine)} cảnh báo")
+    except Exception as e:
+        logging.error(f"Lỗi load alerts: {str(e)}")
+    return engine
+
+
+def save_alerts(engine: AlertEngine) -> None:
+    """Lưu cảnh báo vào alerts.toml."""
+    logging.info("Lưu alerts")
+    try:
+        ALERTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(ALERTS_PATH, "w") as f:
+            toml.dump({"alerts": engine.alerts()}, f)
+        logging.info("Lưu alerts thành công")
+    except Exception as e:
+        logging.error(f"Lỗi lưu alerts: {str(e)}")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AlertEngine:
+    """Engine dùng chung trong process, load từ alerts.toml lần đầu."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = load_alerts()
+        return _engine
+
+
+def format_alert(alert: dict) -> str:
+    """Tạo nội dung tin nhắn cho một cảnh báo."""
+    labels = {
+        'price_above': "Giá vượt lên",
+        'price_below': "Giá giảm xuống dưới",
+        'rsi_above': "RSI vượt lên",
+        'rsi_below': "RSI giảm xuống dưới",
+        'fib_near': "Giá chạm vùng Fib"
+    }
+    text = f"Cảnh báo {alert['coin']}: {labels.get(alert['kind'], alert['kind'])} {alert['threshold']:,.2f} (hiện tại {alert['value']:,.2f})"
+    if alert.get('note'):
+        text += f" - {alert['note']}"
+    return text
+
+
+def notify_alerts(fired: list, token: str, chat_id: str) -> None:
+    """Gửi các cảnh báo vừa kích hoạt qua Telegram (gộp một tin nhắn)."""
+    if not fired:
+        return
+    from modules.notifications import send_telegram_message
+    message = "\n".join(format_alert(alert) for alert in fired)
+    logging.info(f"Kích hoạt {len(fired)} cảnh báo")
+    try:
+        send_telegram_message(token, chat_id, message, "")
+    except Exception as e:
+        logging.error(f"Lỗi gửi cảnh báo: {str(e)}")
@@ -1,18 +1,25 @@
 import pandas as pd
 import numpy as np
-from ta.momentum import RSIIndicator
-from ta.trend import MACD, ADXIndicator
-from ta.volatility import BollingerBands
 import streamlit as st
 import logging
 from datetime import datetime
 from modules.api import GEMINI_API_KEY
 from modules.notifications import send_telegram_message
 from modules.plotting import plot_data
+from modules.metrics import span, timed
+from modules.alerts import get_engine, notify_alerts, save_alerts
+from modules.history import record_run
+from modules.indicators import compute as compute_indicators
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 def calculate_fibonacci_levels(df: pd.DataFrame) -> dict:
     """Tính các mức Fibonacci."""
@@ -77,233 +84,311 @@ def get_trend(latest_data: pd.Series) -> str:
         logging.error(f"Lỗi xác định xu hướng: {str(e)}")
         return "Đi ngang"
 
-def get_gemini_recommendation(latest_data: pd.Series, fib_level: str, support: float, resistance: float, coin: str) -> dict:
-    """Lấy khuyến nghị từ Gemini API."""
-    logging.info(f"Gọi Gemini API cho {coin}")
-    if not GEMINI_API_KEY:
-        logging.warning("Thiếu GEMINI_API_KEY, không gọi được Gemini")
-        # Fallback strategy
-        trend = get_trend(latest_data)
-        rsi = float(latest_data['rsi']) if not pd.isna(latest_data['rsi']) else 50.0
-        price = float(latest_data['price']) if not pd.isna(latest_data['price']) else 0.0
-        strategy = "Giữ"
-        target = []
-        if trend == "Tăng" and rsi < 70:
-            strategy = "Nên Mua vì giá đang tăng và chưa vào vùng quá mua."
-            target = [resistance + 0.1 * (resistance - support), resistance + 0.2 * (resistance - support)]
-        elif trend == "Giảm" and rsi > 30:
-            strategy = "Nên Bán vì giá đang giảm và chưa vào vùng quá bán."
-            target = [support - 0.1 * (resistance - support), support - 0.2 * (resistance - support)]
-        return {
-            "strategy": [
-                {
-                    "trend": f"Thị trường đang {trend.lower()}",
-                    "strategy": strategy,
-                    "target": target
-                }
-            ]
-        }
+AI_WAIT_SECONDS = float(os.getenv("AI_WAIT_SECONDS", "2"))
+AI_DEADLINE_SECONDS = float(os.getenv("AI_DEADLINE_SECONDS", "8"))
+GEMINI_URL = os.getenv("GEMINI_URL", "https://generativelanguage.googleapis.com/v1beta")
+
+class CircuitBreaker:
+    """Ngắt gọi API sau nhiều lần lỗi liên tiếp, thử lại một lần sau `reset_after` giây.
+
+    Mỗi request chỉ gọi allow() một lần; request được cho qua phải gọi record() đúng một lần.
+    """
+
+    def __init__(self, max_failures: int = 3, reset_after: float = 300):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.probing else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: chỉ cho đúng một request thử, các request khác vẫn bị chặn tới khi có kết quả
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                if self.opened_at is None:
+                    logging.warning(f"Circuit breaker mở sau {self.failures} lỗi liên tiếp")
+                self.opened_at = time.monotonic()
+
+gemini_breaker = CircuitBreaker()
+_ai_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+# Khuyến nghị AI đang chờ theo (session Streamlit, coin), UI nâng cấp kết quả khi có phản hồi
+pending_recommendations = {}
+_pending_lock = threading.Lock()
+
+def _session_key() -> str:
+    """Id session Streamlit đang chạy script, chuỗi rỗng nếu gọi ngoài Streamlit."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else ""
+
+def rule_based_recommendation(latest_data: pd.Series, support: float, resistance: float) -> dict:
+    """Chiến lược mặc định theo luật (xu hướng + RSI), không cần AI."""
+    trend = get_trend(latest_data)
+    rsi = float(latest_data['rsi']) if not pd.isna(latest_data['rsi']) else 50.0
+    strategy = "Giữ"
+    target = []
+    if trend == "Tăng" and rsi < 70:
+        strategy = "Nên Mua vì giá đang tăng và chưa vào vùng quá mua."
+        target = [resistance + 0.1 * (resistance - support), resistance + 0.2 * (resistance - support)]
+    elif trend == "Giảm" and rsi > 30:
+        strategy = "Nên Bán vì giá đang giảm và chưa vào vùng quá bán."
+        target = [support - 0.1 * (resistance - support), support - 0.2 * (resistance - support)]
+    return {
+        "strategy": [
+            {
+                "trend": f"Thị trường đang {trend.lower()}",
+                "strategy": strategy,
+                "target": target
+            }
+        ]
+    }
+
+def _request_gemini(latest_data: pd.Series, fib_level: str, support: float, resistance: float, coin: str,
+                    retries: int = 3, backoff: float = 1) -> dict:
+    """Gọi Gemini API, ném lỗi nếu thất bại."""
+    price = float(latest_data['price']) if not pd.isna(latest_data['price']) else 0.0
+    rsi = float(latest_data['rsi']) if not pd.isna(latest_data['rsi']) and isinstance(latest_data['rsi'], (int, float)) else 0.0
+    macd = float(latest_data['macd']) if not pd.isna(latest_data['macd']) and isinstance(latest_data['macd'], (int, float)) else 0.0
+    macd_signal = float(latest_data['macd_signal']) if not pd.isna(latest_data['macd_signal']) and isinstance(latest_data['macd_signal'], (int, float)) else 0.0
+    bb_high = float(latest_data['bb_high']) if not pd.isna(latest_data['bb_high']) and isinstance(latest_data['bb_high'], (int, float)) else 0.0
+    bb_low = float(latest_data['bb_low']) if not pd.isna(latest_data['bb_low']) and isinstance(latest_data['bb_low'], (int, float)) else 0.0
+    adx = float(latest_data.get('adx', 20)) if not pd.isna(latest_data.get('adx', 20)) and isinstance(latest_data.get('adx', 20), (int, float)) else 20.0
     
-    try:
-        price = float(latest_data['price']) if not pd.isna(latest_data['price']) else 0.0
-        rsi = float(latest_data['rsi']) if not pd.isna(latest_data['rsi']) and isinstance(latest_data['rsi'], (int, float)) else 0.0
-        macd = float(latest_data['macd']) if not pd.isna(latest_data['macd']) and isinstance(latest_data['macd'], (int, float)) else 0.0
-        macd_signal = float(latest_data['macd_signal']) if not pd.isna(latest_data['macd_signal']) and isinstance(latest_data['macd_signal'], (int, float)) else 0.0
-        bb_high = float(latest_data['bb_high']) if not pd.isna(latest_data['bb_high']) and isinstance(latest_data['bb_high'], (int, float)) else 0.0
-        bb_low = float(latest_data['bb_low']) if not pd.isna(latest_data['bb_low']) and isinstance(latest_data['bb_low'], (int, float)) else 0.0
-        adx = float(latest_data.get('adx', 20)) if not pd.isna(latest_data.get('adx', 20)) and isinstance(latest_data.get('adx', 20), (int, float)) else 20.0
-        
-        logging.info(f"Dữ liệu Gemini: price={price}, rsi={rsi}, macd={macd}, macd_signal={macd_signal}, adx={adx}")
-        
-        prompt = (
-            f"Bạn là một chuyên gia giao dịch tiền mã hóa (crypto trading expert), nhiệm vụ là phân tích dữ liệu kỹ thuật và đưa ra nhận định, chiến lược đơn giản, dễ hiểu, phù hợp cho người mới bắt đầu (entry-level trader).\n\n"
-            f"Dữ liệu kỹ thuật của đồng {coin} như sau:\n"
-            f"- Giá hiện tại: ${price:,.2f}\n"
-            f"- **RSI (Relative Strength Index)**: {rsi:.1f} → mức quá bán nếu <30, quá mua nếu >70\n"
-            f"- **MACD**: {macd:.0f}, **Signal**: {macd_signal:.0f} → cho thấy động lượng tăng/giảm giá\n"
-            f"- **Bollinger Bands**: Dải trên {bb_high:,.0f}, dải dưới {bb_low:,.0f} → giúp nhận biết biến động giá\n"
-            f"- **ADX (Average Directional Index)**: {adx:.1f} → trên 25 là xu hướng rõ ràng, dưới 20 là yếu hoặc đi ngang\n"
-            f"- **Fibonacci mức gần nhất**: {fib_level or 'không xác định'} → hỗ trợ xác định vùng bật lại hoặc đảo chiều\n"
-            f"- **Vùng hỗ trợ**: {support:.0f}, **vùng kháng cự**: {resistance:.0f} → các mốc giá quan trọng có thể bật lên hoặc bị chặn lại\n\n"
-            f"Hãy phân tích bằng tiếng Việt rõ ràng, dễ hiểu, chia thành 3 phần:\n"
-            f"1. **Nhận định xu hướng hiện tại**: Ví dụ thị trường đang tăng, giảm hay đi ngang? Dựa vào các chỉ số kỹ thuật trên.\n"
-            f"2. **Chiến lược gợi ý đơn giản**: Nên MUA, BÁN hay GIỮ? Giải thích ngắn gọn và dễ hiểu lý do để người mới có thể làm theo.\n"
-            f"3. **Mục tiêu giá (nếu có)**: Nếu mua thì kỳ vọng bán ở giá nào? Nếu bán thì nên chờ mua lại ở đâu?\n\n"
-            f"Lưu ý: Tránh dùng quá nhiều thuật ngữ phức tạp. Hướng dẫn phải thân thiện, dễ hành động, giống như bạn đang cố giúp một người bạn mới học giao dịch.\n"
-            f"Trả về JSON với format:\n"
-            f"{{\n"
-            f"    \"strategy\": [\n"
-            f"        {{\n"
-            f"            \"trend\": \"string\",\n"
-            f"            \"strategy\": \"string\",\n"
-            f"            \"target\": [number, number]\n"
-            f"        }}\n"
-            f"    ]\n"
-            f"}}"
-        )
-        
-        headers = {"Content-Type": "application/json"}
-        payload = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {"response_mime_type": "application/json"}
-        }
-        session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+    logging.info(f"Dữ liệu Gemini: price={price}, rsi={rsi}, macd={macd}, macd_signal={macd_signal}, adx={adx}")
+    
+    prompt = (
+        f"Bạn là một chuyên gia giao dịch tiền mã hóa (crypto trading expert), nhiệm vụ là phân tích dữ liệu kỹ thuật và đưa ra nhận định, chiến lược đơn giản, dễ hiểu, phù hợp cho người mới bắt đầu (entry-level trader).\n\n"
+        f"Dữ liệu kỹ thuật của đồng {coin} như sau:\n"
+        f"- Giá hiện tại: ${price:,.2f}\n"
+        f"- **RSI (Relative Strength Index)**: {rsi:.1f} → mức quá bán nếu <30, quá mua nếu >70\n"
+        f"- **MACD**: {macd:.0f}, **Signal**: {macd_signal:.0f} → cho thấy động lượng tăng/giảm giá\n"
+        f"- **Bollinger Bands**: Dải trên {bb_high:,.0f}, dải dưới {bb_low:,.0f} → giúp nhận biết biến động giá\n"
+        f"- **ADX (Average Directional Index)**: {adx:.1f} → trên 25 là xu hướng rõ ràng, dưới 20 là yếu hoặc đi ngang\n"
+        f"- **Fibonacci mức gần nhất**: {fib_level or 'không xác định'} → hỗ trợ xác định vùng bật lại hoặc đảo chiều\n"
+        f"- **Vùng hỗ trợ**: {support:.0f}, **vùng kháng cự**: {resistance:.0f} → các mốc giá quan trọng có thể bật lên hoặc bị chặn lại\n\n"
+        f"Hãy phân tích bằng tiếng Việt rõ ràng, dễ hiểu, chia thành 3 phần:\n"
+        f"1. **Nhận định xu hướng hiện tại**: Ví dụ thị trường đang tăng, giảm hay đi ngang? Dựa vào các chỉ số kỹ thuật trên.\n"
+        f"2. **Chiến lược gợi ý đơn giản**: Nên MUA, BÁN hay GIỮ? Giải thích ngắn gọn và dễ hiểu lý do để người mới có thể làm theo.\n"
+        f"3. **Mục tiêu giá (nếu có)**: Nếu mua thì kỳ vọng bán ở giá nào? Nếu bán thì nên chờ mua lại ở đâu?\n\n"
+        f"Lưu ý: Tránh dùng quá nhiều thuật ngữ phức tạp. Hướng dẫn phải thân thiện, dễ hành động, giống như bạn đang cố giúp một người bạn mới học giao dịch.\n"
+        f"Trả về JSON với format:\n"
+        f"{{\n"
+        f"    \"strategy\": [\n"
+        f"        {{\n"
+        f"            \"trend\": \"string\",\n"
+        f"            \"strategy\": \"string\",\n"
+        f"            \"target\": [number, number]\n"
+        f"        }}\n"
+        f"    ]\n"
+        f"}}"
+    )
+    
+    headers = {"Content-Type": "application/json"}
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"response_mime_type": "application/json"}
+    }
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504])
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    with span("gemini", coin):
         response = session.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}",
+            f"{GEMINI_URL}/models/gemini-2.5-flash-preview-05-20:generateContent?key={GEMINI_API_KEY}",
             json=payload, headers=headers, timeout=5
         )
         response.raise_for_status()
         result = response.json()
         content = result["candidates"][0]["content"]["parts"][0]["text"]
-        logging.info(f"Gemini API trả về cho {coin}: {content}")
-        gem_result = json.loads(content)
-        
-        # Fallback nếu Gemini trả về rỗng
-        if not gem_result.get('strategy') or len(gem_result['strategy']) == 0:
-            logging.warning(f"Gemini API trả về rỗng cho {coin}, dùng chiến lược mặc định")
-            trend = get_trend(latest_data)
-            strategy = "Giữ"
-            target = []
-            if trend == "Tăng" and rsi < 70:
-                strategy = "Nên Mua vì giá đang tăng và chưa vào vùng quá mua."
-                target = [resistance + 0.1 * (resistance - support), resistance + 0.2 * (resistance - support)]
-            elif trend == "Giảm" and rsi > 30:
-                strategy = "Nên Bán vì giá đang giảm và chưa vào vùng quá bán."
-                target = [support - 0.1 * (resistance - support), support - 0.2 * (resistance - support)]
-            return {
-                "strategy": [
-                    {
-                        "trend": f"Thị trường đang {trend.lower()}",
-                        "strategy": strategy,
-                        "target": target
-                    }
-                ]
-            }
-        
-        return gem_result
+    logging.info(f"Gemini API trả về cho {coin}: {content}")
+    gem_result = json.loads(content)
+    return gem_result
+
+def _ai_recommendation(latest_data: pd.Series, fib_level: str, support: float, resistance: float, coin: str,
+                       retries: int = 3, backoff: float = 1, check_breaker: bool = True) -> Optional[dict]:
+    """Khuyến nghị từ Gemini, None nếu không có key, breaker mở, lỗi hoặc trả về rỗng.
+
+    check_breaker=False khi người gọi đã được gemini_breaker.allow() cho qua.
+    """
+    if not GEMINI_API_KEY:
+        logging.warning("Thiếu GEMINI_API_KEY, không gọi được Gemini")
+        return None
+    if check_breaker and not gemini_breaker.allow():
+        logging.warning(f"Circuit breaker Gemini đang mở, bỏ qua gọi API cho {coin}")
+        return None
+    try:
+        gem_result = _request_gemini(latest_data, fib_level, support, resistance, coin, retries, backoff)
+        gemini_breaker.record(True)
     except Exception as e:
         logging.error(f"Lỗi Gemini API cho {coin}: {str(e)}")
-        # Fallback strategy
-        trend = get_trend(latest_data)
-        rsi = float(latest_data['rsi']) if not pd.isna(latest_data['rsi']) else 50.0
-        price = float(latest_data['price']) if not pd.isna(latest_data['price']) else 0.0
-        strategy = "Giữ"
-        target = []
-        if trend == "Tăng" and rsi < 70:
-            strategy = "Nên Mua vì giá đang tăng và chưa vào vùng quá mua."
-            target = [resistance + 0.1 * (resistance - support), resistance + 0.2 * (resistance - support)]
-        elif trend == "Giảm" and rsi > 30:
-            strategy = "Nên Bán vì giá đang giảm và chưa vào vùng quá bán."
-            target = [support - 0.1 * (resistance - support), support - 0.2 * (resistance - support)]
-        return {
-            "strategy": [
-                {
-                    "trend": f"Thị trường đang {trend.lower()}",
-                    "strategy": strategy,
-                    "target": target
-                }
-            ]
-        }
+        gemini_breaker.record(False)
+        return None
+    if not gem_result.get('strategy') or len(gem_result['strategy']) == 0:
+        logging.warning(f"Gemini API trả về rỗng cho {coin}, dùng chiến lược mặc định")
+        return None
+    return gem_result
+
+def get_gemini_recommendation(latest_data: pd.Series, fib_level: str, support: float, resistance: float, coin: str) -> dict:
+    """Lấy khuyến nghị từ Gemini API."""
+    logging.info(f"Gọi Gemini API cho {coin}")
+    gem_result = _ai_recommendation(latest_data, fib_level, support, resistance, coin)
+    return gem_result if gem_result is not None else rule_based_recommendation(latest_data, support, resistance)
+
+class AIRecommendation:
+    """Khuyến nghị có sẵn ngay theo luật, được nâng cấp bằng kết quả Gemini nếu về trước deadline."""
+
+    def __init__(self, fallback: dict, future=None, budget: float = AI_DEADLINE_SECONDS):
+        self.fallback = fallback
+        self.future = future
+        self.deadline = time.monotonic() + budget
+        # Thời điểm Gemini trả lời, để phân biệt phản hồi về muộn sau deadline
+        self.completed_at = None
+        if future is not None:
+            future.add_done_callback(self._on_done)
+
+    def _on_done(self, future) -> None:
+        self.completed_at = time.monotonic()
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def done(self) -> bool:
+        return self.future is None or self.future.done() or self.expired()
 
-def calculate_indicators(df: pd.DataFrame) -> pd.DataFrame:
-    """Tính các chỉ báo kỹ thuật."""
+    def result(self, wait: float = 0.0) -> tuple:
+        """Trả về (khuyến nghị, có_phải_AI), chờ tối đa `wait` giây nhưng không quá deadline."""
+        if self.future is None:
+            return self.fallback, False
+        timeout = max(0.0, min(wait, self.deadline - time.monotonic()))
+        try:
+            gem_result = self.future.result(timeout=timeout)
+        except Exception:
+            return self.fallback, False
+        # Callback có thể chưa chạy ngay khi future.result() trả về; lúc đó lấy thời điểm hiện tại
+        completed_at = self.completed_at or time.monotonic()
+        if gem_result is None or completed_at > self.deadline:
+            return self.fallback, False
+        return gem_result, True
+
+def request_recommendation(latest_data: pd.Series, fib_level: str, support: float, resistance: float, coin: str,
+                           budget: float = AI_DEADLINE_SECONDS) -> AIRecommendation:
+    """Tính ngay chiến lược theo luật và gửi yêu cầu Gemini bất đồng bộ trong giới hạn `budget` giây."""
+    fallback = rule_based_recommendation(latest_data, support, resistance)
+    if not GEMINI_API_KEY or not gemini_breaker.allow():
+        return AIRecommendation(fallback, None, budget)
+    # Một lần retry ngắn để thread không chạy quá lâu sau deadline; breaker đã kiểm tra ở trên
+    future = _ai_executor.submit(_ai_recommendation, latest_data, fib_level, support, resistance, coin, 1, 0.5, False)
+    return AIRecommendation(fallback, future, budget)
+
+# Cột chỉ báo mà luật tín hiệu và các panel biểu đồ cần
+SIGNAL_INDICATORS = ['rsi', 'macd', 'macd_signal', 'bb_high', 'bb_low', 'adx']
+CHART_INDICATORS = ['rsi', 'macd', 'macd_signal', 'macd_diff', 'adx']
+ALL_INDICATORS = ['rsi', 'macd', 'macd_signal', 'macd_diff', 'bb_high', 'bb_low', 'bb_mid', 'adx']
+ANALYSIS_INDICATORS = list(dict.fromkeys(SIGNAL_INDICATORS + CHART_INDICATORS))
+
+def calculate_indicators(df: pd.DataFrame, columns: Optional[list] = None) -> pd.DataFrame:
+    """Tính các chỉ báo kỹ thuật (chỉ các cột trong `columns`, mặc định tất cả) qua registry chỉ báo."""
     logging.info("Tính chỉ báo kỹ thuật")
     try:
         if not all(col in df.columns for col in ['price', 'high', 'low']):
             logging.error("Thiếu cột price, high, hoặc low trong DataFrame")
             return df
         
-        # RSI
-        df['rsi'] = RSIIndicator(close=df['price'], window=14).rsi().fillna(0)
-        
-        # MACD
-        macd = MACD(close=df['price'])
-        df['macd'] = macd.macd().fillna(0)
-        df['macd_signal'] = macd.macd_signal().fillna(0)
-        df['macd_diff'] = macd.macd_diff().fillna(0)
-        
-        # Bollinger Bands
-        bb = BollingerBands(close=df['price'], window=20)
-        df['bb_high'] = bb.bollinger_hband().fillna(0)
-        df['bb_low'] = bb.bollinger_lband().fillna(0)
-        df['bb_mid'] = bb.bollinger_mavg().fillna(0)
+        columns = columns or ALL_INDICATORS
+        for col, series in compute_indicators(df, columns).items():
+            # ADX thiếu dữ liệu mặc định 20 (xu hướng yếu), các chỉ báo khác mặc định 0
+            df[col] = pd.to_numeric(series, errors='coerce').fillna(20 if col == 'adx' else 0)
         
-        # ADX
-        adx = ADXIndicator(high=df['high'], low=df['low'], close=df['price'], window=14)
-        df['adx'] = adx.adx().fillna(20)
-        
-        # Chuyển đổi kiểu dữ liệu
-        for col in ['rsi', 'macd', 'macd_signal', 'macd_diff', 'bb_high', 'bb_low', 'bb_mid', 'adx']:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        
-        logging.info(f"Các cột chỉ báo: {df[['rsi', 'macd', 'macd_signal', 'adx']].tail(1).to_dict()}")
+        logging.info(f"Các cột chỉ báo: {df[columns].tail(1).to_dict()}")
         return df
     except Exception as e:
         logging.error(f"Lỗi tính chỉ báo: {str(e)}")
         return df
 
-def generate_signals(df: pd.DataFrame, fib_levels: dict, coin: str) -> tuple:
-    """Tạo tín hiệu giao dịch."""
-    logging.info(f"Tạo tín hiệu cho {coin}")
-    try:
-        df = df.copy()
-        df['signal'] = 'Hold'
-        df['rsi_signal_str'] = df['rsi'].apply(lambda x: 'Sell' if float(x) > 70 else 'Buy' if float(x) < 30 else 'Hold')
-        df['macd_signal_str'] = df.apply(lambda x: 'Buy' if float(x['macd']) > float(x['macd_signal']) else 'Sell' if float(x['macd']) < float(x['macd_signal']) else 'Hold', axis=1)
-        df['bb_signal_str'] = df.apply(lambda x: 'Sell' if float(x['price']) > float(x['bb_high']) else 'Buy' if float(x['price']) < float(x['bb_low']) else 'Hold', axis=1)
-        df['fib_signal_str'] = 'Hold'
-        
-        for index, row in df.iterrows():
-            fib_level = is_near_fib_level(row['price'], fib_levels)
-            if fib_level in ['fib_0.236', 'fib_0.382', 'fib_0.5']:
-                df.at[index, 'fib_signal_str'] = 'Buy'
-            elif fib_level in ['fib_0.618', 'fib_0.786', 'fib_1.0']:
-                df.at[index, 'fib_signal_str'] = 'Sell'
-        
-        latest = df.iloc[-1]
-        logging.info(f"Latest data: {latest[['price', 'rsi', 'macd', 'macd_signal', 'adx']].to_dict()}")
-        
-        fib_level = is_near_fib_level(latest['price'], fib_levels)
-        support, resistance = get_support_resistance(df, fib_levels)
-        gem_result = get_gemini_recommendation(latest, fib_level, support, resistance, coin)
-        
-        if 'gemini_signal' not in df.columns:
-            df['gemini_signal'] = ''
-        if 'gemini_reason' not in df.columns:
-            df['gemini_reason'] = ''
-        
-        last_index = df.index[-1]
-        gemini_signal = json.dumps(gem_result, ensure_ascii=False, indent=2) if gem_result.get('strategy') else 'No strategy'
-        gemini_reason = 'AI Strategy'
-        df.at[last_index, 'gemini_signal'] = gemini_signal
-        df.at[last_index, 'gemini_reason'] = gemini_reason
-        
-        df['buy_signal_count'] = (
-            (df['rsi_signal_str'] == 'Buy').astype(int) +
-            (df['macd_signal_str'] == 'Buy').astype(int) +
-            (df['bb_signal_str'] == 'Buy').astype(int) +
-            (df['fib_signal_str'] == 'Buy').astype(int)
-        )
-        df['sell_signal_count'] = (
-            (df['rsi_signal_str'] == 'Sell').astype(int) +
-            (df['macd_signal_str'] == 'Sell').astype(int) +
-            (df['bb_signal_str'] == 'Sell').astype(int) +
-            (df['fib_signal_str'] == 'Sell').astype(int)
-        )
-        
-        df.loc[(df['buy_signal_count'] > 0), 'signal'] = 'Long'
-        df.loc[(df['sell_signal_count'] > 0) & (df['adx'] > 20), 'signal'] = 'Short'
-        
-        logging.info(f"Buy signals: {df['buy_signal_count'].tail(1).to_dict()}, Sell signals: ${df['sell_signal_count'].tail(1).to_dict()}")
-        logging.info(f"Tín hiệu {coin}: {df[['signal']].tail().to_dict()}")
-        return df, gem_result
-    except Exception as e:
-        logging.error(f"Lỗi tạo tín hiệu {coin}: {str(e)}")
-        return df, {'strategy': []}
+def compute_signals(df: pd.DataFrame, fib_levels: dict) -> pd.DataFrame:
+    """Tính cột tín hiệu theo luật (RSI, MACD, BB, Fib), không gọi AI."""
+    df = df.copy()
+    df['signal'] = 'Hold'
+    # Vector hóa để chạy được trên lịch sử dài (archive, backtest hàng loạt)
+    price = df['price'].astype(float)
+    rsi = df['rsi'].astype(float)
+    macd = df['macd'].astype(float)
+    macd_signal = df['macd_signal'].astype(float)
+    df['rsi_signal_str'] = np.select([rsi > 70, rsi < 30], ['Sell', 'Buy'], 'Hold')
+    df['macd_signal_str'] = np.select([macd > macd_signal, macd < macd_signal], ['Buy', 'Sell'], 'Hold')
+    df['bb_signal_str'] = np.select([price > df['bb_high'].astype(float), price < df['bb_low'].astype(float)], ['Sell', 'Buy'], 'Hold')
+    
+    # Mức Fib đầu tiên (theo thứ tự dict) nằm trong dung sai 1%, giống is_near_fib_level
+    fib_signal = pd.Series('Hold', index=df.index, dtype=object)
+    matched = pd.Series(False, index=df.index)
+    for level_name, level_price in fib_levels.items():
+        near = ((price - level_price).abs() / price < 0.01) & ~matched
+        if level_name in ['fib_0.236', 'fib_0.382', 'fib_0.5']:
+            fib_signal[near] = 'Buy'
+        elif level_name in ['fib_0.618', 'fib_0.786', 'fib_1.0']:
+            fib_signal[near] = 'Sell'
+        matched |= near
+    df['fib_signal_str'] = fib_signal
+    
+    df['buy_signal_count'] = (
+        (df['rsi_signal_str'] == 'Buy').astype(int) +
+        (df['macd_signal_str'] == 'Buy').astype(int) +
+        (df['bb_signal_str'] == 'Buy').astype(int) +
+        (df['fib_signal_str'] == 'Buy').astype(int)
+    )
+    df['sell_signal_count'] = (
+        (df['rsi_signal_str'] == 'Sell').astype(int) +
+        (df['macd_signal_str'] == 'Sell').astype(int) +
+        (df['bb_signal_str'] == 'Sell').astype(int) +
+        (df['fib_signal_str'] == 'Sell').astype(int)
+    )
+    
+    df.loc[(df['buy_signal_count'] > 0), 'signal'] = 'Long'
+    df.loc[(df['sell_signal_count'] > 0) & (df['adx'] > 20), 'signal'] = 'Short'
+    return df
+
+def apply_recommendation(df: pd.DataFrame, gem_result: dict, reason: str = 'AI Strategy') -> pd.DataFrame:
+    """Ghi khuyến nghị vào cột gemini_signal/gemini_reason của hàng cuối."""
+    if 'gemini_signal' not in df.columns:
+        df['gemini_signal'] = ''
+    if 'gemini_reason' not in df.columns:
+        df['gemini_reason'] = ''
+    
+    last_index = df.index[-1]
+    gemini_signal = json.dumps(gem_result, ensure_ascii=False, indent=2) if gem_result.get('strategy') else 'No strategy'
+    df.at[last_index, 'gemini_signal'] = gemini_signal
+    df.at[last_index, 'gemini_reason'] = reason
+    return df
+
+def format_strategy_output(gem_result: dict, from_ai: bool = True) -> str:
+    """Phần chiến lược trong báo cáo, ghi rõ nguồn (Gemini AI hay luật mặc định)."""
+    strategy_output = "\n### AI Strategy\n"
+    strategy_output += "Chiến lược từ Gemini AI:\n" if from_ai else "Chiến lược mặc định (theo luật, chưa có phản hồi AI):\n"
+    strategy_output += json.dumps(gem_result, ensure_ascii=False, indent=4)
+    return strategy_output
 
-def get_latest_signal(df: pd.DataFrame, fib_levels: dict, coin: str) -> tuple:
+def get_latest_signal(df: pd.DataFrame, fib_levels: dict, coin: str, gem_result: Optional[dict] = None,
+                      from_ai: bool = True) -> tuple:
     """In tín hiệu mới nhất."""
     logging.info(f"In tín hiệu cho {coin}")
     try:
@@ -332,12 +417,11 @@ def get_latest_signal(df: pd.DataFrame, fib_levels: dict, coin: str) -> tuple:
             f"- **Fib**: {fib_level or 'N/A'}\n"
         )
 
-        support, resistance = get_support_resistance(df, fib_levels)
-        gem_result = get_gemini_recommendation(latest, fib_level, support, resistance, coin)
+        if gem_result is None:
+            support, resistance = get_support_resistance(df, fib_levels)
+            gem_result = get_gemini_recommendation(latest, fib_level, support, resistance, coin)
 
-        strategy_output = "\n### AI Strategy\n"
-        strategy_output += f"Chiến lược từ Gemini AI:\n"
-        strategy_output += json.dumps(gem_result, ensure_ascii=False, indent=4)
+        strategy_output = format_strategy_output(gem_result, from_ai)
 
         logging.info(f"Tín hiệu {coin}: {strategy_output}")
         return output, strategy_output, gem_result
@@ -345,8 +429,15 @@ def get_latest_signal(df: pd.DataFrame, fib_levels: dict, coin: str) -> tuple:
         logging.error(f"Error in get_latest_signal for {coin}: {str(e)}")
         return "", "", {'strategy': []}
 
-def analyze_crypto(coin: str, days: int = 30) -> dict:
-    """Phân tích dữ liệu crypto và trả về kết quả."""
+@timed("analysis", failed=lambda result: not result or result[0] is None)
+def analyze_crypto(coin: str, days: int = 30, render_chart: bool = True, interactive: bool = True,
+                   send_telegram: bool = False) -> dict:
+    """Phân tích dữ liệu crypto và trả về kết quả (render_chart=False bỏ qua ảnh PNG matplotlib, trừ khi gửi Telegram).
+
+    send_telegram=True gửi kết quả (kèm ảnh PNG) lên Telegram.
+
+    interactive=False (chạy theo lịch) chờ Gemini tới AI_DEADLINE_SECONDS thay vì AI_WAIT_SECONDS.
+    """
     from modules.api import fetch_crypto_data, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
     logging.info(f"Starting analysis for {coin} at {datetime.now()}")
     try:
@@ -358,8 +449,30 @@ def analyze_crypto(coin: str, days: int = 30) -> dict:
             return None, None, None, None, None
             
         fib_levels = calculate_fibonacci_levels(crypto_data)
-        crypto_data = calculate_indicators(crypto_data)
-        crypto_data, gem_result = generate_signals(crypto_data, fib_levels, coin)
+        with span("indicators", coin) as s:
+            crypto_data = calculate_indicators(crypto_data, ANALYSIS_INDICATORS)
+            s.rows = len(crypto_data)
+        
+        # Kết quả gửi đi (Telegram, chạy theo lịch) không được nâng cấp sau, nên chờ Gemini tới deadline
+        wait_ai = interactive and not send_telegram
+        
+        # Gửi yêu cầu Gemini bất đồng bộ, tính tín hiệu theo luật trong lúc chờ
+        latest = crypto_data.iloc[-1]
+        support, resistance = get_support_resistance(crypto_data, fib_levels)
+        recommendation = request_recommendation(latest, is_near_fib_level(latest['price'], fib_levels), support, resistance, coin)
+        with span("signals", coin) as s:
+            crypto_data = compute_signals(crypto_data, fib_levels)
+            s.rows = len(crypto_data)
+        with span("ai_wait", coin) as s:
+            gem_result, from_ai = recommendation.result(wait=AI_WAIT_SECONDS if wait_ai else AI_DEADLINE_SECONDS)
+            s.status = "ok" if from_ai else "fallback"
+        key = (_session_key(), coin)
+        with _pending_lock:
+            if from_ai or recommendation.done() or not interactive:
+                pending_recommendations.pop(key, None)
+            else:
+                pending_recommendations[key] = recommendation
+        crypto_data = apply_recommendation(crypto_data, gem_result, 'AI Strategy' if from_ai else 'Rule Strategy')
         
         if not isinstance(crypto_data.index, pd.RangeIndex):
             logging.warning(f"Invalid index type for {coin} DataFrame, resetting index")
@@ -370,10 +483,25 @@ def analyze_crypto(coin: str, days: int = 30) -> dict:
             logging.error("Missing 'signal' column in crypto_data")
             return None, None, None, None, None
             
-        signal_output, strategy_output, gem_result = get_latest_signal(crypto_data, fib_levels, coin)
-        chart_path = plot_data(crypto_data, fib_levels, coin)
+        with span("latest_signal", coin):
+            signal_output, strategy_output, gem_result = get_latest_signal(crypto_data, fib_levels, coin, gem_result, from_ai)
+        chart_path = None
+        # Tin Telegram luôn kèm ảnh PNG, kể cả khi UI hiển thị biểu đồ tương tác
+        if render_chart or send_telegram:
+            with span("plot", coin) as s:
+                chart_path = plot_data(crypto_data, fib_levels, coin)
+                s.status = "ok" if chart_path else "error"
+        
+        with span("history", coin) as s:
+            s.rows = record_run(coin, crypto_data, gem_result, 'ai' if from_ai else 'rule')
         
         latest = crypto_data.iloc[-1]
+        engine = get_engine()
+        # Cảnh báo gần mức Fib đi theo các mức vừa tính lại
+        if engine.refresh_fib_alerts(coin, fib_levels):
+            save_alerts(engine)
+        fired = engine.update(coin, price=latest['price'], rsi=latest['rsi'])
+        notify_alerts(fired, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)
         logging.info(f"Final latest data for {coin}: {latest[['price', 'rsi', 'macd', 'macd_signal', 'adx', 'signal']].to_dict()}")
         
         fib_level = is_near_fib_level(latest['price'], fib_levels)
@@ -400,16 +528,17 @@ def analyze_crypto(coin: str, days: int = 30) -> dict:
             f"Lý do: {latest.get('gemini_reason', 'N/A')}"
         )
 
-        if st.session_state.get('analysis_triggered', False):
+        if send_telegram:
             try:
                 logging.info("Sending Telegram notification")
-                send_telegram_message(
-                    TELEGRAM_TOKEN,
-                    TELEGRAM_CHAT_ID,
-                    message,
-                    signal_output + strategy_output,
-                    chart_path
-                )
+                with span("telegram", coin):
+                    send_telegram_message(
+                        TELEGRAM_TOKEN,
+                        TELEGRAM_CHAT_ID,
+                        message,
+                        signal_output + strategy_output,
+                        chart_path
+                    )
                 logging.info("Telegram message sent successfully")
             except Exception as e:
                 logging.error(f"Error sending Telegram message: {str(e)}")
@@ -420,3 +549,17 @@ def analyze_crypto(coin: str, days: int = 30) -> dict:
         logging.error(f"Error analyzing {coin}: {str(e)}")
         st.error(f"Error analyzing: {str(e)}")
         return None, None, None, None, None
+
+def upgrade_recommendation(coin: str) -> Optional[str]:
+    """Nếu khuyến nghị Gemini đang chờ của coin (trong session hiện tại) đã về trước deadline, trả về phần chiến lược mới."""
+    key = (_session_key(), coin)
+    with _pending_lock:
+        recommendation = pending_recommendations.get(key)
+        if recommendation is None or not recommendation.done():
+            return None
+        pending_recommendations.pop(key, None)
+    gem_result, from_ai = recommendation.result()
+    if not from_ai:
+        return None
+    logging.info(f"Nâng cấp chiến lược {coin} bằng phản hồi Gemini")
+    return format_strategy_output(gem_result, True)
@@ -3,61 +3,121 @@ import requests
 import logging
 from datetime import datetime, timedelta
 import os
-import time
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from modules.metrics import span
+from modules.ratelimit import RateLimiter
 
 # API keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your_gemini_api_key")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "7244322730:AAHRDYtejK2DHP4fzh4d67oZQ46ZNaH_MVY")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "-1002672318636")
 
+# Giới hạn gọi CoinGecko dùng chung cho phân tích, cảnh báo và backfill
+COINGECKO_URL = os.getenv("COINGECKO_URL", "https://api.coingecko.com/api/v3")
+COINGECKO_LIMITER = RateLimiter(float(os.getenv("COINGECKO_RATE", "1")), burst=1)
+
+COIN_MAP = {
+    "BTC": "bitcoin",
+    "SUI": "sui",
+    "BNB": "binancecoin",
+    "ETH": "ethereum",
+    "ADA": "cardano",
+    "SOL": "solana",
+    "Pi": "pi-network"
+}
+
 def fetch_crypto_data(coin: str, days: int = 30) -> pd.DataFrame:
     """Lấy dữ liệu crypto từ CoinGecko."""
     logging.info(f"Fetching data for {coin}, days={days}")
     
-    coin_map = {
-        "BTC": "bitcoin",
-        "SUI": "sui",
-        "BNB": "binancecoin",
-        "ETH": "ethereum",
-        "ADA": "cardano",
-        "SOL": "solana",
-        "Pi": "pi-network"
-    }
+    coin_id = COIN_MAP.get(coin, coin.lower())
     
-    coin_id = coin_map.get(coin, coin.lower())
+    with span("fetch", coin) as s:
+        try:
+            COINGECKO_LIMITER.acquire()  # Tránh giới hạn API
+            url = f"{COINGECKO_URL}/coins/{coin_id}/market_chart"
+            params = {
+                "vs_currency": "usd",
+                "days": days,
+                "interval": "daily"
+            }
+            session = requests.Session()
+            retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+            session.mount("https://", HTTPAdapter(max_retries=retries))
+            response = session.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            logging.info(f"Response status for {coin}: {response.status_code}, keys: {response.json().keys()}")
+            data = response.json()
+        
+            if not data.get("prices"):
+                logging.error(f"No price data for {coin_id}")
+                s.status = "empty"
+                return pd.DataFrame()
+        
+            prices = data["prices"]
+            df = pd.DataFrame(prices, columns=["timestamp", "price"])
+            df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
+            df["high"] = df["price"] * 1.01
+            df["low"] = df["price"] * 0.99
+            df.set_index("timestamp", inplace=True)
+        
+            s.rows = len(df)
+            logging.info(f"Fetched {len(df)} rows for {coin} with columns: {df.columns.tolist()}")
+            return df
     
-    try:
-        time.sleep(1)  # Tránh giới hạn API
-        url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Lỗi lấy dữ liệu {coin}: {str(e)}")
+            s.status = "error"
+            return pd.DataFrame()
+
+def fetch_latest_prices(coins: list) -> dict:
+    """Lấy giá hiện tại của nhiều coin trong một lần gọi CoinGecko."""
+    logging.info(f"Fetching latest prices for {coins}")
+    ids = {COIN_MAP.get(coin, coin.lower()): coin for coin in coins}
+    with span("fetch_prices", "") as s:
+        try:
+            url = f"{COINGECKO_URL}/simple/price"
+            params = {"ids": ",".join(ids), "vs_currencies": "usd"}
+            COINGECKO_LIMITER.acquire()
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+            prices = {ids[coin_id]: float(value["usd"]) for coin_id, value in data.items() if coin_id in ids and "usd" in value}
+            s.rows = len(prices)
+            return prices
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error(f"Lỗi lấy giá hiện tại: {str(e)}")
+            s.status = "error"
+            return {}
+
+def fetch_crypto_range(coin: str, start: datetime, end: datetime) -> pd.DataFrame:
+    """Lấy dữ liệu CoinGecko trong khoảng [start, end] (endpoint market_chart/range)."""
+    logging.info(f"Fetching range for {coin}: {start} → {end}")
+    coin_id = COIN_MAP.get(coin, coin.lower())
+    with span("fetch_range", coin) as s:
+        COINGECKO_LIMITER.acquire()
+        url = f"{COINGECKO_URL}/coins/{coin_id}/market_chart/range"
         params = {
             "vs_currency": "usd",
-            "days": days,
-            "interval": "daily"
+            "from": int(pd.Timestamp(start).timestamp()),
+            "to": int(pd.Timestamp(end).timestamp())
         }
         session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        retries = Retry(total=5, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
         session.mount("https://", HTTPAdapter(max_retries=retries))
-        response = session.get(url, params=params, timeout=10)
+        response = session.get(url, params=params, timeout=30)
         response.raise_for_status()
-        logging.info(f"Response status for {coin}: {response.status_code}, keys: {response.json().keys()}")
         data = response.json()
-        
         if not data.get("prices"):
-            logging.error(f"No price data for {coin_id}")
+            s.status = "empty"
             return pd.DataFrame()
-        
-        prices = data["prices"]
-        df = pd.DataFrame(prices, columns=["timestamp", "price"])
+        df = pd.DataFrame(data["prices"], columns=["timestamp", "price"])
+        if data.get("total_volumes") and len(data["total_volumes"]) == len(df):
+            df["volume"] = [v[1] for v in data["total_volumes"]]
         df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
         df["high"] = df["price"] * 1.01
         df["low"] = df["price"] * 0.99
         df.set_index("timestamp", inplace=True)
-        
-        logging.info(f"Fetched {len(df)} rows for {coin} with columns: {df.columns.tolist()}")
+        s.rows = len(df)
         return df
-    
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Lỗi lấy dữ liệu {coin}: {str(e)}")
-        return pd.DataFrame()
\ No newline at end of file
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ARCHIVE_FIELDS = ['price', 'high', 'low', 'volume']
+
+# Mỗi coin một thư mục, mỗi lần ghi tạo một thư mục phiên bản chứa đủ các cột .npy (float64),
+# timestamp.npy (int64 ns, UTC, tăng dần) và meta.json. File CURRENT trỏ tới phiên bản hiện hành
+# và chỉ được thay (os.replace) sau khi phiên bản mới ghi xong, nên reader luôn thấy một bản nhất quán.
+CURRENT_FILE = "CURRENT"
+
+
+def _coin_dir(coin: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or ARCHIVE_DIR, coin)
+
+
+def _version_dir(coin_dir: str) -> Optional[str]:
+    """Thư mục phiên bản hiện hành (archive cũ không có CURRENT thì đọc thẳng thư mục coin)."""
+    pointer = os.path.join(coin_dir, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as f:
+            return os.path.join(coin_dir, f.read().strip())
+    if os.path.exists(os.path.join(coin_dir, "meta.json")):
+        return coin_dir
+    return None
+
+
+def _to_ns(value) -> int:
+    return int(pd.Timestamp(value).value)
+
+
+def write_archive(coin: str, df: pd.DataFrame, root: Optional[str] = None) -> Optional[int]:
+    """Gộp DataFrame (index thời gian) vào archive, bỏ trùng theo timestamp; trả về số hàng, None nếu ghi lỗi."""
+    logging.info(f"Ghi archive cho {coin}: {len(df)} hàng")
+    version_dir = None
+    try:
+        if df.empty:
+            return 0
+        new = df[[col for col in ARCHIVE_FIELDS if col in df.columns]].astype('float64')
+        new.index = pd.DatetimeIndex(new.index)
+        existing = load_frame(coin, root=root)
+        if existing is not None and not existing.empty:
+            # Dữ liệu mới ghi đè bar cũ trùng timestamp
+            merged = pd.concat([existing, new])
+            merged = merged[~merged.index.duplicated(keep='last')]
+        else:
+            merged = new
+        merged = merged.sort_index()
+
+        coin_dir = _coin_dir(coin, root)
+        os.makedirs(coin_dir, exist_ok=True)
+        previous = _version_dir(coin_dir)
+        version_dir = tempfile.mkdtemp(prefix="v", dir=coin_dir)
+        columns = {'timestamp': merged.index.asi8.astype('int64')}
+        for col in merged.columns:
+            columns[col] = merged[col].to_numpy(dtype='float64')
+        for name, values in columns.items():
+            np.save(os.path.join(version_dir, f"{name}.npy"), values)
+        meta = {
+            'coin': coin,
+            'fields': [col for col in merged.columns],
+            'rows': len(merged),
+            'start': str(merged.index[0]),
+            'end': str(merged.index[-1])
+        }
+        with open(os.path.join(version_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # Chuyển CURRENT sang phiên bản mới trong một bước
+        tmp_pointer = os.path.join(coin_dir, f"{CURRENT_FILE}.tmp")
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            f.write(os.path.basename(version_dir))
+        os.replace(tmp_pointer, os.path.join(coin_dir, CURRENT_FILE))
+        # Giữ bản ngay trước cho reader vừa đọc CURRENT; reader đang mmap bản cũ hơn vẫn giữ dữ liệu (POSIX)
+        keep = {os.path.basename(version_dir), os.path.basename(previous or "")}
+        for name in os.listdir(coin_dir):
+            if name.startswith("v") and name not in keep and os.path.isdir(os.path.join(coin_dir, name)):
+                shutil.rmtree(os.path.join(coin_dir, name), ignore_errors=True)
+        logging.info(f"Archive {coin}: {len(merged)} hàng ({meta['start']} → {meta['end']})")
+        return len(merged)
+    except Exception as e:
+        logging.error(f"Lỗi ghi archive {coin}: {str(e)}")
+        if version_dir:
+            shutil.rmtree(version_dir, ignore_errors=True)
+        return None
+
+
+class ArchiveReader:
+    """Đọc archive một coin qua memmap chỉ-đọc, cắt theo khoảng thời gian không cần nạp toàn bộ."""
+
+    def __init__(self, coin: str, root: Optional[str] = None):
+        self.coin = coin
+        self.path = _version_dir(_coin_dir(coin, root))
+        if self.path is None:
+            raise FileNotFoundError(f"Chưa có archive cho {coin}")
+        with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.fields = self.meta.get('fields', [])
+        # Mở mọi cột ngay để tất cả thuộc cùng một phiên bản
+        self.timestamps = np.load(os.path.join(self.path, "timestamp.npy"), mmap_mode='r')
+        self._columns = {field: np.load(os.path.join(self.path, f"{field}.npy"), mmap_mode='r') for field in self.fields}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def column(self, field: str) -> np.ndarray:
+        return self._columns[field]
+
+    def bounds(self, start=None, end=None) -> tuple:
+        """Vị trí [lo, hi) của khoảng [start, end] trên chỉ mục timestamp."""
+        lo = 0 if start is None else int(np.searchsorted(self.timestamps, _to_ns(start), side='left'))
+        hi = len(self.timestamps) if end is None else int(np.searchsorted(self.timestamps, _to_ns(end), side='right'))
+        return lo, hi
+
+    def arrays(self, start=None, end=None, fields: Optional[list] = None) -> Dict[str, np.ndarray]:
+        """Trả về view memmap (zero-copy) của các cột trong khoảng thời gian."""
+        lo, hi = self.bounds(start, end)
+        result = {'timestamp': self.timestamps[lo:hi]}
+        for field in fields or self.fields:
+            result[field] = self.column(field)[lo:hi]
+        return result
+
+    def frame(self, start=None, end=None, fields: Optional[list] = None) -> pd.DataFrame:
+        """DataFrame (index timestamp) của khoảng thời gian, cùng format với fetch_crypto_data."""
+        data = self.arrays(start, end, fields)
+        index = pd.DatetimeIndex(np.asarray(data.pop('timestamp')).view('datetime64[ns]'), name='timestamp')
+        return pd.DataFrame({field: np.asarray(values) for field, values in data.items()}, index=index)
+
+
+def open_archive(coin: str, root: Optional[str] = None) -> Optional[ArchiveReader]:
+    """Mở archive của coin, trả về None nếu chưa có."""
+    try:
+        if _version_dir(_coin_dir(coin, root)) is None:
+            return None
+        return ArchiveReader(coin, root)
+    except Exception as e:
+        logging.error(f"Lỗi mở archive {coin}: {str(e)}")
+        return None
+
+
+def load_frame(coin: str, start=None, end=None, root: Optional[str] = None) -> Optional[pd.DataFrame]:
+    """Đọc một khoảng thời gian từ archive thành DataFrame."""
+    reader = open_archive(coin, root)
+    if reader is None:
+        return None
+    return reader.frame(start, end)
+
+
+def list_archived_coins(root: Optional[str] = None) -> list:
+    """Danh sách coin đã có archive."""
+    root = root or ARCHIVE_DIR
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if _version_dir(os.path.join(root, name)) is not None)
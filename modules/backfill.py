@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+from modules.archive import write_archive
+from modules.ratelimit import RateLimiter
+
+CHECKPOINT_DIR = "data/backfill"
+SOURCES = ('coingecko', 'ccxt')
+# CoinGecko trả dữ liệu theo giờ cho khoảng 2-90 ngày
+DEFAULT_CHUNK_DAYS = 90
+DEFAULT_WORKERS = 4
+FLUSH_EVERY = 8
+
+
+def split_range(start: datetime, end: datetime, chunk_days: int) -> list:
+    """Chia [start, end) thành các đoạn chunk_days ngày."""
+    chunks = []
+    cursor = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    step = pd.Timedelta(days=chunk_days)
+    while cursor < end:
+        chunk_end = min(cursor + step, end)
+        chunks.append((cursor, chunk_end))
+        cursor = chunk_end
+    return chunks
+
+
+class Checkpoint:
+    """Ghi lại các đoạn đã tải xong (theo nguồn + coin) để chạy lại thì tiếp tục."""
+
+    def __init__(self, source: str, coin: str, directory: str = CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{source}_{coin}.json")
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.done = {tuple(item) for item in json.load(f).get("done", [])}
+
+    @staticmethod
+    def key(chunk: tuple) -> tuple:
+        return int(chunk[0].value // 1_000_000), int(chunk[1].value // 1_000_000)
+
+    def is_done(self, chunk: tuple) -> bool:
+        return self.key(chunk) in self.done
+
+    def mark(self, chunks: list) -> None:
+        with self._lock:
+            self.done.update(self.key(chunk) for chunk in chunks)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"done": sorted(self.done)}, f)
+            os.replace(tmp_path, self.path)
+
+
+_ccxt_clients = {}
+_ccxt_lock = threading.Lock()
+
+
+def _ccxt_client(exchange: str) -> tuple:
+    """Client ccxt + RateLimiter dùng chung cho mọi thread của một sàn (ccxt chỉ giới hạn theo từng instance)."""
+    import ccxt
+
+    with _ccxt_lock:
+        if exchange not in _ccxt_clients:
+            client = getattr(ccxt, exchange)({"enableRateLimit": True})
+            # rateLimit của ccxt là khoảng cách tối thiểu giữa hai request (ms)
+            _ccxt_clients[exchange] = (client, RateLimiter(1000 / client.rateLimit, burst=1))
+        return _ccxt_clients[exchange]
+
+
+def fetch_ccxt_range(coin: str, start: datetime, end: datetime, exchange: str = "binance",
+                     timeframe: str = "1h") -> pd.DataFrame:
+    """Lấy nến OHLCV thật từ sàn qua ccxt trong khoảng [start, end)."""
+    from modules.metrics import span
+
+    client, limiter = _ccxt_client(exchange)
+    symbol = f"{coin.upper()}/USDT"
+    since = int(pd.Timestamp(start).value // 1_000_000)
+    until = int(pd.Timestamp(end).value // 1_000_000)
+    rows = []
+    with span("fetch_ccxt", coin) as s:
+        while since < until:
+            limiter.acquire()
+            batch = client.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=1000)
+            if not batch:
+                break
+            rows.extend(row for row in batch if row[0] < until)
+            if batch[-1][0] + 1 <= since:
+                break
+            since = batch[-1][0] + 1
+        s.rows = len(rows)
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=["timestamp", "open", "high", "low", "price", "volume"])
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
+    return df.set_index("timestamp")[["price", "high", "low", "volume"]]
+
+
+def _fetch_chunk(source: str, coin: str, chunk: tuple, exchange: str, timeframe: str) -> pd.DataFrame:
+    if source == 'ccxt':
+        return fetch_ccxt_range(coin, chunk[0], chunk[1], exchange, timeframe)
+    from modules.api import fetch_crypto_range
+    return fetch_crypto_range(coin, chunk[0], chunk[1])
+
+
+def backfill(coins: list, start: datetime, end: datetime, source: str = 'coingecko',
+             chunk_days: int = DEFAULT_CHUNK_DAYS, workers: int = DEFAULT_WORKERS,
+             exchange: str = "binance", timeframe: str = "1h", archive_root: Optional[str] = None,
+             checkpoint_dir: str = CHECKPOINT_DIR) -> dict:
+    """Tải song song lịch sử nhiều coin theo từng đoạn, checkpoint để chạy tiếp, ghi vào archive."""
+    if source not in SOURCES:
+        raise ValueError(f"Nguồn không hợp lệ: {source}")
+    checkpoints = {coin: Checkpoint(source, coin, checkpoint_dir) for coin in coins}
+    tasks = [
+        (coin, chunk)
+        for coin in coins
+        for chunk in split_range(start, end, chunk_days)
+        if not checkpoints[coin].is_done(chunk)
+    ]
+    logging.info(f"Backfill {source}: {len(tasks)} đoạn cần tải cho {coins}")
+
+    buffers = {coin: [] for coin in coins}
+    locks = {coin: threading.Lock() for coin in coins}
+    summary = {coin: {'chunks': 0, 'rows': 0, 'failed': 0} for coin in coins}
+
+    def flush(coin: str) -> None:
+        # Gộp các đoạn trong buffer rồi ghi một lần (archive tự bỏ trùng theo timestamp)
+        with locks[coin]:
+            items = buffers[coin]
+            buffers[coin] = []
+            if not items:
+                return
+            frames = [df for _, df in items if not df.empty]
+            if frames and write_archive(coin, pd.concat(frames), root=archive_root) is None:
+                # Không đánh dấu checkpoint để lần chạy sau tải lại các đoạn này
+                logging.error(f"Ghi archive {coin} lỗi, {len(items)} đoạn sẽ được tải lại")
+                summary[coin]['failed'] += len(items)
+                return
+            checkpoints[coin].mark([chunk for chunk, _ in items])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_fetch_chunk, source, coin, chunk, exchange, timeframe): (coin, chunk)
+            for coin, chunk in tasks
+        }
+        for future in as_completed(futures):
+            coin, chunk = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                logging.error(f"Lỗi tải {coin} {chunk[0]} → {chunk[1]}: {str(e)}")
+                summary[coin]['failed'] += 1
+                continue
+            summary[coin]['chunks'] += 1
+            summary[coin]['rows'] += len(df)
+            with locks[coin]:
+                buffers[coin].append((chunk, df))
+                full = len(buffers[coin]) >= FLUSH_EVERY
+            if full:
+                flush(coin)
+    for coin in coins:
+        flush(coin)
+    logging.info(f"Backfill xong: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tải lịch sử giá nhiều coin vào archive, có thể chạy tiếp khi bị ngắt")
+    parser.add_argument("--coins", nargs="+", default=["BTC", "ETH", "SOL"])
+    parser.add_argument("--start", required=True, help="Ngày bắt đầu, ví dụ 2021-01-01")
+    parser.add_argument("--end", default=None, help="Ngày kết thúc (mặc định: hiện tại)")
+    parser.add_argument("--source", default="coingecko", choices=SOURCES)
+    parser.add_argument("--chunk-days", type=int, default=DEFAULT_CHUNK_DAYS)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--exchange", default="binance")
+    parser.add_argument("--timeframe", default="1h")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s - %(message)s')
+    end = pd.Timestamp(args.end) if args.end else pd.Timestamp.now().floor("h")
+    summary = backfill(args.coins, pd.Timestamp(args.start), end, args.source, args.chunk_days,
+                       args.workers, args.exchange, args.timeframe)
+    for coin, stats in summary.items():
+        print(f"{coin}: {stats['chunks']} đoạn, {stats['rows']} hàng, {stats['failed']} lỗi")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import logging
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+MAX_POINTS = 2000
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: chọn `threshold` điểm giữ hình dạng chuỗi, trả về vị trí."""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket đầu và cuối chỉ có một điểm, các bucket giữa chia đều n-2 điểm còn lại
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(df: pd.DataFrame, column: str, threshold: int = MAX_POINTS) -> pd.DataFrame:
+    """Giảm số điểm của một cột bằng LTTB, trả về DataFrame (timestamp, value)."""
+    series = df[column].astype(float)
+    x = np.arange(len(series)) if not isinstance(df.index, pd.DatetimeIndex) else df.index.asi8
+    idx = lttb_indices(x, np.nan_to_num(series.to_numpy()), threshold)
+    return pd.DataFrame({'timestamp': df.index[idx], 'value': series.to_numpy()[idx], 'series': column})
+
+
+def prepare_chart_data(crypto_data: pd.DataFrame, threshold: int = MAX_POINTS) -> dict:
+    """Dữ liệu đã giảm điểm cho từng panel (price, RSI, MACD, ADX)."""
+    df = crypto_data
+    if 'timestamp' in df.columns:
+        df = df.set_index('timestamp')
+    panels = {'price': ['price'], 'rsi': ['rsi'], 'macd': ['macd', 'macd_signal', 'macd_diff'], 'adx': ['adx']}
+    data = {}
+    for panel, columns in panels.items():
+        columns = [col for col in columns if col in df.columns]
+        if columns:
+            data[panel] = pd.concat([downsample(df, col, threshold) for col in columns], ignore_index=True)
+    logging.info(f"Chuẩn bị dữ liệu biểu đồ: {len(df)} hàng → {sum(len(v) for v in data.values())} điểm")
+    return data
+
+
+def build_interactive_chart(chart_data: dict, fib_levels: dict, coin: str, height: int = 180) -> alt.VConcatChart:
+    """Biểu đồ tương tác (render trên trình duyệt) gồm giá + Fib, RSI, MACD, ADX, zoom đồng bộ trục thời gian."""
+    zoom = alt.selection_interval(bind='scales', encodings=['x'])
+    x = alt.X('timestamp:T', title=None)
+
+    def lines(panel: str, title: str, y_scale=None):
+        y = alt.Y('value:Q', title=title, scale=y_scale or alt.Scale(zero=False))
+        return alt.Chart(chart_data[panel]).mark_line().encode(
+            x=x, y=y, color=alt.Color('series:N', legend=alt.Legend(orient='right')),
+            tooltip=['timestamp:T', 'series:N', alt.Tooltip('value:Q', format=',.4f')]
+        )
+
+    def rules(values: dict, color: str = 'gray'):
+        frame = pd.DataFrame({'level': list(values), 'value': list(values.values())})
+        return alt.Chart(frame).mark_rule(strokeDash=[4, 4], color=color, opacity=0.6).encode(
+            y='value:Q', tooltip=['level:N', alt.Tooltip('value:Q', format=',.4f')]
+        )
+
+    charts = []
+    if 'price' in chart_data:
+        charts.append((lines('price', f"{coin} (USD)") + rules(fib_levels or {})).properties(title=f"{coin} Giá với Fibonacci"))
+    if 'rsi' in chart_data:
+        charts.append((lines('rsi', "RSI", alt.Scale(domain=[0, 100])) + rules({'70': 70, '30': 30}, 'red')).properties(title="RSI"))
+    if 'macd' in chart_data:
+        macd_lines = chart_data['macd'][chart_data['macd']['series'] != 'macd_diff']
+        macd_bars = chart_data['macd'][chart_data['macd']['series'] == 'macd_diff']
+        bars = alt.Chart(macd_bars).mark_bar(opacity=0.3, color='gray').encode(x=x, y='value:Q')
+        line = alt.Chart(macd_lines).mark_line().encode(x=x, y=alt.Y('value:Q', title="MACD"), color='series:N')
+        charts.append((bars + line).properties(title="MACD"))
+    if 'adx' in chart_data:
+        charts.append((lines('adx', "ADX", alt.Scale(domain=[0, 50])) + rules({'25': 25}, 'green')).properties(title="ADX"))
+    charts = [chart.properties(height=height).add_params(zoom) for chart in charts]
+    return alt.vconcat(*charts).resolve_scale(x='shared')
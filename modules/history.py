@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+HISTORY_DB = os.getenv("HISTORY_DB", "data/history.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signals (
+    coin TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    signal TEXT NOT NULL,
+    price REAL,
+    rsi REAL,
+    macd REAL,
+    macd_signal REAL,
+    bb_high REAL,
+    bb_low REAL,
+    adx REAL,
+    buy_count INTEGER,
+    sell_count INTEGER,
+    fwd_return REAL,
+    PRIMARY KEY (coin, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_signals_coin_signal_ts ON signals (coin, signal, ts);
+CREATE TABLE IF NOT EXISTS signal_daily (
+    coin TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    signal TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    evaluated INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    sum_return REAL NOT NULL,
+    PRIMARY KEY (coin, day, signal)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    coin TEXT NOT NULL,
+    run_at INTEGER NOT NULL,
+    ts INTEGER,
+    signal TEXT,
+    price REAL,
+    source TEXT,
+    strategy TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_coin_run_at ON runs (coin, run_at);
+"""
+
+SIGNAL_COLUMNS = ['price', 'rsi', 'macd', 'macd_signal', 'bb_high', 'bb_low', 'adx']
+DAY_MS = 86400 * 1000
+# PRAGMA user_version của schema hiện tại
+SCHEMA_VERSION = 1
+
+_local = threading.local()
+
+
+def _connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Kết nối SQLite theo thread (WAL cho phép đọc song song khi đang ghi)."""
+    path = path or HISTORY_DB
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        connections[path] = conn
+    return conn
+
+
+def _rebuild_daily(conn: sqlite3.Connection, coin: str, first_day: int, last_day: int) -> None:
+    """Tính lại bảng tổng hợp theo ngày của coin cho các ngày [first_day, last_day] từ bảng signals."""
+    conn.execute(
+        "DELETE FROM signal_daily WHERE coin = ? AND day BETWEEN ? AND ?", (coin, first_day, last_day)
+    )
+    conn.execute(
+        "INSERT INTO signal_daily (coin, day, signal, n, evaluated, hits, sum_return) "
+        "SELECT coin, ts / ?, signal, COUNT(*), COUNT(fwd_return), "
+        "SUM(CASE WHEN (signal = 'Long' AND fwd_return > 0) OR (signal = 'Short' AND fwd_return < 0) THEN 1 ELSE 0 END), "
+        "COALESCE(SUM(CASE WHEN signal = 'Short' THEN -fwd_return ELSE fwd_return END), 0) "
+        "FROM signals WHERE coin = ? AND ts >= ? AND ts < ? GROUP BY coin, ts / ?, signal",
+        (DAY_MS, coin, first_day * DAY_MS, (last_day + 1) * DAY_MS, DAY_MS)
+    )
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Nâng cấp dữ liệu cũ theo PRAGMA user_version (chạy một lần cho mỗi file DB)."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with conn:
+        if version < 1:
+            # Bản cũ ghi cả điểm giá "hiện tại" (không rơi vào mốc 00:00 UTC) như một bar; bỏ chúng
+            # và tính lại tổng hợp của những ngày bị ảnh hưởng
+            affected = conn.execute(
+                "SELECT coin, MIN(ts / ?), MAX(ts / ?) FROM signals WHERE ts % ? != 0 GROUP BY coin",
+                (DAY_MS, DAY_MS, DAY_MS)
+            ).fetchall()
+            conn.execute("DELETE FROM signals WHERE ts % ? != 0", (DAY_MS,))
+            for coin, first_day, last_day in affected:
+                _rebuild_daily(conn, coin, first_day, last_day)
+            if affected:
+                logging.info(f"Migration lịch sử: bỏ bar đang chạy cũ của {[row[0] for row in affected]}")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _to_ms(value) -> int:
+    return int(pd.Timestamp(value).value // 1_000_000)
+
+
+def record_run(coin: str, df: pd.DataFrame, gem_result: Optional[dict] = None, source: str = 'ai',
+               path: Optional[str] = None) -> int:
+    """Ghi tín hiệu từng bar đã đóng + snapshot chỉ báo và chiến lược của lần chạy (một transaction, executemany).
+
+    Bar đang chạy (điểm giá "hiện tại" trong ngày) chỉ ghi vào bảng runs; tín hiệu đã ghi của một bar
+    không bị ghi đè, chỉ bổ sung fwd_return khi có bar kế tiếp.
+    """
+    logging.info(f"Ghi lịch sử tín hiệu {coin}: {len(df)} hàng")
+    try:
+        if df is None or df.empty or 'signal' not in df.columns:
+            return 0
+        frame = df.set_index('timestamp') if 'timestamp' in df.columns else df
+        run_ts = int(pd.DatetimeIndex(frame.index).asi8[-1] // 1_000_000)
+        # Chỉ giữ bar đã đóng (mốc ngày không muộn hơn 00:00 UTC hôm nay)
+        closed = frame[pd.DatetimeIndex(frame.index).asi8 // 1_000_000 <= int(time.time() * 1000) // DAY_MS * DAY_MS]
+        ts = pd.DatetimeIndex(closed.index).asi8 // 1_000_000
+        prices = closed['price'].to_numpy(dtype=float)
+        # Lợi nhuận bar kế tiếp để đánh giá độ chính xác tín hiệu
+        fwd_return = np.full(len(prices), np.nan)
+        fwd_return[:-1] = prices[1:] / prices[:-1] - 1
+        out = pd.DataFrame({'coin': coin, 'ts': ts, 'signal': closed['signal'].astype(str).to_numpy()})
+        for col in SIGNAL_COLUMNS:
+            out[col] = closed[col].to_numpy(dtype=float) if col in closed.columns else np.nan
+        out['buy_count'] = closed['buy_signal_count'].to_numpy(dtype='int64') if 'buy_signal_count' in closed.columns else 0
+        out['sell_count'] = closed['sell_signal_count'].to_numpy(dtype='int64') if 'sell_signal_count' in closed.columns else 0
+        out['fwd_return'] = fwd_return
+        # NaN → NULL
+        out = out.astype(object).where(out.notna(), None)
+        rows = list(out.itertuples(index=False, name=None))
+        conn = _connect(path)
+        with conn:
+            if rows:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO signals (coin, ts, signal, price, rsi, macd, macd_signal, bb_high, bb_low, adx, "
+                    "buy_count, sell_count, fwd_return) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                # Bar cuối của lần trước giờ đã có bar kế tiếp
+                conn.executemany(
+                    "UPDATE signals SET fwd_return = ? WHERE coin = ? AND ts = ? AND fwd_return IS NULL",
+                    [(row[-1], coin, row[1]) for row in rows if row[-1] is not None]
+                )
+                # Cập nhật bảng tổng hợp theo ngày cho các ngày vừa ghi
+                _rebuild_daily(conn, coin, int(ts.min() // DAY_MS), int(ts.max() // DAY_MS))
+            # Tín hiệu bar đang chạy chỉ lưu theo lần chạy
+            latest = frame.iloc[-1]
+            conn.execute(
+                "INSERT INTO runs (coin, run_at, ts, signal, price, source, strategy) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (coin, int(time.time() * 1000), run_ts, str(latest['signal']), float(latest['price']), source,
+                 json.dumps(gem_result or {}, ensure_ascii=False))
+            )
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Lỗi ghi lịch sử {coin}: {str(e)}")
+        return 0
+
+
+def query_signals(coin: str, signal: Optional[str] = None, since=None, until=None, limit: int = 10000,
+                  path: Optional[str] = None) -> pd.DataFrame:
+    """Truy vấn tín hiệu theo coin (và loại tín hiệu) trong khoảng thời gian, dùng index (coin, signal, ts)."""
+    sql = "SELECT ts, signal, price, rsi, macd, macd_signal, adx, fwd_return FROM signals WHERE coin = ?"
+    params = [coin]
+    if signal:
+        sql += " AND signal = ?"
+        params.append(signal)
+    if since is not None:
+        sql += " AND ts >= ?"
+        params.append(_to_ms(since))
+    if until is not None:
+        sql += " AND ts <= ?"
+        params.append(_to_ms(until))
+    sql += " ORDER BY ts DESC LIMIT ?"
+    params.append(int(limit))
+    try:
+        df = pd.read_sql_query(sql, _connect(path), params=params)
+        df['timestamp'] = pd.to_datetime(df.pop('ts'), unit='ms')
+        return df.set_index('timestamp')
+    except Exception as e:
+        logging.error(f"Lỗi truy vấn lịch sử {coin}: {str(e)}")
+        return pd.DataFrame()
+
+
+def signal_accuracy(coin: Optional[str] = None, since=None, path: Optional[str] = None) -> pd.DataFrame:
+    """Độ chính xác tín hiệu Long/Short theo coin (bar kế tiếp đi đúng hướng), đọc từ bảng tổng hợp theo ngày."""
+    sql = ("SELECT coin, signal, SUM(n) AS signals, SUM(evaluated) AS evaluated, SUM(hits) AS hits, "
+           "SUM(sum_return) AS sum_return FROM signal_daily WHERE signal IN ('Long', 'Short')")
+    params = []
+    if coin:
+        sql += " AND coin = ?"
+        params.append(coin)
+    if since is not None:
+        sql += " AND day >= ?"
+        params.append(_to_ms(since) // DAY_MS)
+    sql += " GROUP BY coin, signal ORDER BY coin, signal"
+    try:
+        df = pd.read_sql_query(sql, _connect(path), params=params)
+        evaluated = df['evaluated'].where(df['evaluated'] > 0)
+        df['accuracy'] = df['hits'] / evaluated * 100
+        df['avg_return'] = df['sum_return'] / evaluated * 100
+        return df.drop(columns=['sum_return'])
+    except Exception as e:
+        logging.error(f"Lỗi tính độ chính xác tín hiệu: {str(e)}")
+        return pd.DataFrame()
+
+
+def recent_runs(coin: Optional[str] = None, limit: int = 50, path: Optional[str] = None) -> pd.DataFrame:
+    """Các lần phân tích gần nhất kèm chiến lược AI."""
+    sql = "SELECT coin, run_at, ts, signal, price, source, strategy FROM runs"
+    params = []
+    if coin:
+        sql += " WHERE coin = ?"
+        params.append(coin)
+    sql += " ORDER BY run_at DESC LIMIT ?"
+    params.append(int(limit))
+    try:
+        df = pd.read_sql_query(sql, _connect(path), params=params)
+        df['run_at'] = pd.to_datetime(df['run_at'], unit='ms')
+        df['ts'] = pd.to_datetime(df['ts'], unit='ms')
+        return df
+    except Exception as e:
+        logging.error(f"Lỗi truy vấn lần chạy: {str(e)}")
+        return pd.DataFrame()
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from ta.momentum import RSIIndicator
+from ta.trend import ADXIndicator
+
+from modules.metrics import current_span
+
+MEMO_SIZE = 256
+
+
+class Indicator:
+    """Một nút trong đồ thị chỉ báo: cột đầu vào thô, nút phụ thuộc, tham số và các cột đầu ra."""
+
+    def __init__(self, name: str, func: Callable, inputs: tuple, deps: tuple, outputs: tuple, params: dict):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.deps = deps
+        self.outputs = outputs
+        self.params = params
+
+
+REGISTRY: Dict[str, Indicator] = {}
+_producers: Dict[str, str] = {}
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def indicator(name: str, inputs: tuple = (), deps: tuple = (), outputs: Optional[tuple] = None, **params):
+    """Decorator đăng ký chỉ báo: func(data, **params) trả về dict {cột: Series}."""
+    def decorator(func):
+        node = Indicator(name, func, tuple(inputs), tuple(deps), tuple(outputs or (name,)), params)
+        REGISTRY[name] = node
+        for column in node.outputs:
+            _producers[column] = name
+        return func
+    return decorator
+
+
+def _ema(series: pd.Series, window: int) -> pd.Series:
+    # Giống ta.utils._ema với fillna=False
+    return series.ewm(span=window, min_periods=window, adjust=False).mean()
+
+
+# Các nút trung gian dùng chung giữa nhiều chỉ báo
+@indicator('ema_12', inputs=('price',), window=12)
+def _ema_fast(data, window):
+    return {'ema_12': _ema(data['price'], window)}
+
+
+@indicator('ema_26', inputs=('price',), window=26)
+def _ema_slow(data, window):
+    return {'ema_26': _ema(data['price'], window)}
+
+
+@indicator('sma_20', inputs=('price',), window=20)
+def _sma_20(data, window):
+    return {'sma_20': data['price'].rolling(window, min_periods=window).mean()}
+
+
+@indicator('std_20', inputs=('price',), window=20)
+def _std_20(data, window):
+    return {'std_20': data['price'].rolling(window, min_periods=window).std(ddof=0)}
+
+
+# Các chỉ báo dùng cho tín hiệu và biểu đồ
+@indicator('rsi', inputs=('price',), window=14)
+def _rsi(data, window):
+    return {'rsi': RSIIndicator(close=data['price'], window=window).rsi()}
+
+
+@indicator('macd', deps=('ema_12', 'ema_26'), outputs=('macd', 'macd_signal', 'macd_diff'), signal_window=9)
+def _macd(data, signal_window):
+    macd = data['ema_12'] - data['ema_26']
+    macd_signal = _ema(macd, signal_window)
+    return {'macd': macd, 'macd_signal': macd_signal, 'macd_diff': macd - macd_signal}
+
+
+@indicator('bollinger', deps=('sma_20', 'std_20'), outputs=('bb_high', 'bb_low', 'bb_mid'), window_dev=2)
+def _bollinger(data, window_dev):
+    return {
+        'bb_high': data['sma_20'] + window_dev * data['std_20'],
+        'bb_low': data['sma_20'] - window_dev * data['std_20'],
+        'bb_mid': data['sma_20']
+    }
+
+
+@indicator('adx', inputs=('high', 'low', 'price'), window=14)
+def _adx(data, window):
+    return {'adx': ADXIndicator(high=data['high'], low=data['low'], close=data['price'], window=window).adx()}
+
+
+def plan(columns: Iterable[str]) -> list:
+    """Thứ tự tính tối thiểu (topo) các nút cần cho các cột yêu cầu."""
+    order = []
+    visiting = set()
+
+    def visit(name: str) -> None:
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Phụ thuộc vòng tại chỉ báo {name}")
+        visiting.add(name)
+        for dep in REGISTRY[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for column in columns:
+        if column not in _producers:
+            raise KeyError(f"Không có chỉ báo nào tạo cột {column}")
+        visit(_producers[column])
+    return order
+
+
+def _fingerprint(df: pd.DataFrame, column: str) -> str:
+    """Phiên bản của chuỗi đầu vào: hash nội dung + chỉ mục."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(df[column].to_numpy(dtype=float)).tobytes())
+    if isinstance(df.index, pd.DatetimeIndex):
+        digest.update(df.index.asi8.tobytes())
+    else:
+        # Kết quả nhớ được gắn lại theo nhãn chỉ mục, nên chỉ mục khác giá trị phải cho khóa khác
+        digest.update(pd.util.hash_pandas_object(df.index, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _versions(node: Indicator, raw_versions: dict, node_versions: dict) -> tuple:
+    return (tuple(raw_versions[col] for col in node.inputs), tuple(node_versions[dep] for dep in node.deps))
+
+
+def compute(df: pd.DataFrame, columns: Iterable[str]) -> Dict[str, pd.Series]:
+    """Chỉ tính các nút cần thiết, dùng lại nút trung gian và kết quả đã nhớ theo (phiên bản chuỗi, tham số)."""
+    columns = list(columns)
+    order = plan(columns)
+    needed_raw = {col for name in order for col in REGISTRY[name].inputs}
+    raw_versions = {col: _fingerprint(df, col) for col in needed_raw}
+    data = {col: df[col] for col in needed_raw}
+    node_versions = {}
+    hits = misses = 0
+    for name in order:
+        node = REGISTRY[name]
+        key = (name, tuple(sorted(node.params.items())), _versions(node, raw_versions, node_versions))
+        node_versions[name] = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        with _memo_lock:
+            cached = _memo.get(key)
+            if cached is not None:
+                _memo.move_to_end(key)
+        if cached is None:
+            misses += 1
+            cached = node.func(data, **node.params)
+            with _memo_lock:
+                _memo[key] = cached
+                while len(_memo) > MEMO_SIZE:
+                    _memo.popitem(last=False)
+        else:
+            hits += 1
+        data.update(cached)
+    logging.info(f"Chỉ báo {columns}: tính {misses} nút, dùng lại {hits} nút ({order})")
+    # Báo hit/miss theo nút cho span đang đo (ví dụ "indicators" trong analyze_crypto)
+    s = current_span()
+    if s is not None:
+        s.cache_hits += hits
+        s.cache_misses += misses
+    return {column: data[column] for column in columns}
+
+
+def clear_memo() -> None:
+    """Xóa kết quả đã nhớ."""
+    with _memo_lock:
+        _memo.clear()
@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+STEPS = ('connect', 'open', 'login', 'analysis', 'backtest', 'refresh')
+PERCENTILES = (50, 95, 99)
+DAY_MS = 86400 * 1000
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Handler chung cho các API giả: độ trễ cấu hình được, đếm số request."""
+
+    latency = 0.0
+    counts = None
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body: dict, status: int = 200) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        url = urlparse(self.path)
+        with self.lock:
+            self.counts[type(self).__name__] = self.counts.get(type(self).__name__, 0) + 1
+        body = self.route(method, url.path, {k: v[0] for k, v in parse_qs(url.query).items()})
+        if body is None:
+            self._reply({"error": f"Không hỗ trợ {url.path}"}, 404)
+        else:
+            self._reply(body)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def route(self, method: str, path: str, query: dict) -> Optional[dict]:
+        raise NotImplementedError
+
+
+def _random_walk(coin_id: str, start_ms: int, step_ms: int, n: int) -> list:
+    # Cùng coin + thời điểm luôn ra cùng giá để các phiên thấy dữ liệu nhất quán
+    rng = np.random.default_rng(zlib.crc32(coin_id.encode()) + start_ms // step_ms)
+    base = 10 + zlib.crc32(coin_id.encode()) % 50000
+    prices = base * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return [[start_ms + i * step_ms, float(price)] for i, price in enumerate(prices)]
+
+
+class FakeCoinGecko(FakeHandler):
+    def route(self, method, path, query):
+        parts = path.strip("/").split("/")
+        now_ms = int(time.time() * 1000) // DAY_MS * DAY_MS
+        if parts[-1] == "price":
+            ids = [coin_id for coin_id in query.get("ids", "").split(",") if coin_id]
+            return {coin_id: {"usd": _random_walk(coin_id, now_ms, DAY_MS, 1)[0][1]} for coin_id in ids}
+        if len(parts) >= 3 and parts[-3] == "coins" and parts[-1] == "market_chart":
+            days = int(query.get("days", 30))
+            prices = _random_walk(parts[-2], now_ms - days * DAY_MS, DAY_MS, days + 1)
+            return {"prices": prices, "total_volumes": [[ts, 1e9] for ts, _ in prices]}
+        if len(parts) >= 4 and parts[-1] == "range":
+            start_ms, end_ms = int(query["from"]) * 1000, int(query["to"]) * 1000
+            step_ms = 3600 * 1000
+            prices = _random_walk(parts[-3], start_ms, step_ms, max(1, (end_ms - start_ms) // step_ms))
+            return {"prices": prices, "total_volumes": [[ts, 1e9] for ts, _ in prices]}
+        return None
+
+
+class FakeGemini(FakeHandler):
+    def route(self, method, path, query):
+        if not path.endswith(":generateContent"):
+            return None
+        strategy = {"strategy": [{
+            "trend": random.choice(["Tăng", "Giảm", "Đi ngang"]),
+            "strategy": "Chờ tín hiệu xác nhận trước khi vào lệnh (load test)",
+            "target": [100, 120]
+        }]}
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(strategy, ensure_ascii=False)}]}}]}
+
+
+class FakeTelegram(FakeHandler):
+    def route(self, method, path, query):
+        if path.endswith("/sendMessage"):
+            return {"ok": True, "result": {"message_id": 1}}
+        if path.endswith("/sendPhoto"):
+            return {"ok": True, "result": {"message_id": 1, "photo": [{"file_id": "loadtest-file-id"}]}}
+        return None
+
+
+class FakeServices:
+    """Chạy CoinGecko, Gemini và Telegram giả trên localhost, mỗi dịch vụ một cổng."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.counts = {}
+        self.servers = {}
+        for name, handler in (('coingecko', FakeCoinGecko), ('gemini', FakeGemini), ('telegram', FakeTelegram)):
+            handler_cls = type(handler.__name__, (handler,), {'latency': latency_ms / 1000, 'counts': self.counts})
+            self.servers[name] = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.servers[name].server_address[1]}"
+
+    def env(self) -> dict:
+        return {
+            "COINGECKO_URL": self.url('coingecko'),
+            "GEMINI_URL": self.url('gemini'),
+            "TELEGRAM_URL": self.url('telegram')
+        }
+
+    def __enter__(self):
+        for server in self.servers.values():
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+class StreamlitServer:
+    """Chạy app thật (`streamlit run main.py`) trong tiến trình con, trỏ tới các API giả."""
+
+    def __init__(self, env: dict, port: Optional[int] = None, startup_timeout: float = 60):
+        self.port = port or _free_port()
+        self.env = {**os.environ, **env}
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+             "--server.port", str(self.port), "--browser.gatherUsageStats", "false"],
+            cwd=os.path.dirname(APP_PATH), env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1)
+                return self
+            except OSError:
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.5)
+        self.__exit__()
+        raise RuntimeError(f"Streamlit không khởi động được trên cổng {self.port}")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+    def rss_mb(self) -> Optional[float]:
+        """RSS của tiến trình Streamlit (MB), None nếu không đọc được /proc."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Session:
+    """Một phiên trình duyệt giả qua websocket của Streamlit: gửi rerun + trạng thái widget, chờ script chạy xong."""
+
+    def __init__(self, url: str, timeout: float = 120):
+        self.url = url
+        self.timeout = timeout
+        self.ws = None
+        self.widgets = {}
+        self.errors = []
+
+    async def connect(self) -> None:
+        self.ws = await websocket_connect(self.url, subprotocols=["streamlit"])
+
+    def widget_id(self, name: str) -> str:
+        """Tìm widget theo key (hậu tố của id) hoặc theo label trong lần chạy gần nhất."""
+        for widget_id, label in self.widgets.items():
+            if widget_id.endswith(f"-{name}") or label == name:
+                return widget_id
+        raise KeyError(f"Không thấy widget {name}")
+
+    async def rerun(self, **values) -> None:
+        """Chạy lại script với các giá trị widget (True = bấm nút), đợi tới khi script kết thúc hẳn."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        for name, value in values.items():
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = self.widget_id(name)
+            if value is True:
+                state.trigger_value = True
+            else:
+                state.string_value = str(value)
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        self.widgets = {}
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), self.timeout)
+            if raw is None:
+                raise ConnectionError("Websocket bị đóng")
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self._on_element(forward.delta.new_element)
+            elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def _on_element(self, element) -> None:
+        kind = element.WhichOneof("type")
+        proto = getattr(element, kind)
+        if kind == "exception":
+            self.errors.append(f"{proto.type}: {proto.message}")
+        elif kind == "alert" and proto.format == Alert.ERROR:
+            self.errors.append(proto.body)
+        elif getattr(proto, "id", ""):
+            self.widgets[proto.id] = getattr(proto, "label", "")
+
+    async def close(self) -> None:
+        if self.ws:
+            self.ws.close()
+
+
+async def run_session(url: str, refreshes: int = 2, timeout: float = 120) -> tuple:
+    """Một analyst: mở app, đăng nhập, chạy phân tích, backtest, rồi vài lần autorefresh."""
+    session = Session(url, timeout)
+    timings = {}
+    flow = [
+        ('open', {}),
+        ('login', {'Username': "admin", 'Password': "admin", 'Login': True}),
+        ('analysis', {'run_analysis': True}),
+        ('backtest', {'run_backtest': True})
+    ] + [('refresh', {})] * refreshes
+    try:
+        start = time.perf_counter()
+        await session.connect()
+        timings['connect'] = [time.perf_counter() - start]
+        for name, values in flow:
+            start = time.perf_counter()
+            await session.rerun(**values)
+            timings.setdefault(name, []).append(time.perf_counter() - start)
+    except Exception as e:
+        session.errors.append(f"{name if timings else 'connect'}: {type(e).__name__} {str(e)}")
+    return session, {'timings': timings, 'errors': session.errors}
+
+
+def summarize(results: list, wall: float, rss_before: Optional[float], rss_after: Optional[float]) -> dict:
+    """Throughput, p50/p95/p99 từng bước và bộ nhớ trung bình mỗi phiên."""
+    steps = {}
+    for name in STEPS:
+        values = np.array([t for result in results for t in result['timings'].get(name, [])]) * 1000
+        if len(values):
+            steps[name] = {
+                'count': int(len(values)),
+                **{f"p{q}_ms": float(np.percentile(values, q)) for q in PERCENTILES},
+                'max_ms': float(values.max())
+            }
+    reruns = sum(len(t) for result in results for name, t in result['timings'].items() if name != 'connect')
+    memory_per_session = None
+    if rss_before is not None and rss_after is not None and results:
+        memory_per_session = (rss_after - rss_before) / len(results)
+    return {
+        'sessions': len(results),
+        'failed_sessions': sum(1 for result in results if result['errors']),
+        'wall_seconds': wall,
+        'sessions_per_second': len(results) / wall if wall else 0.0,
+        'reruns_per_second': reruns / wall if wall else 0.0,
+        'rss_mb': rss_after,
+        'memory_per_session_mb': memory_per_session,
+        'steps': steps,
+        'errors': [error for result in results for error in result['errors']][:20]
+    }
+
+
+async def _drive(url: str, sessions: int, concurrency: int, refreshes: int, timeout: float,
+                 server: StreamlitServer) -> dict:
+    # Phiên khởi động: import module, khởi tạo cache, không tính vào số liệu
+    warmup, _ = await run_session(url, refreshes=0, timeout=timeout)
+    await warmup.close()
+    rss_before = server.rss_mb()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await run_session(url, refreshes, timeout)
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(limited() for _ in range(sessions)))
+    wall = time.perf_counter() - start
+    # Đo bộ nhớ khi mọi phiên vẫn còn mở (session state còn trong server)
+    rss_after = server.rss_mb()
+    for session, _ in outcomes:
+        await session.close()
+    return summarize([result for _, result in outcomes], wall, rss_before, rss_after)
+
+
+def run_load_test(sessions: int = 10, concurrency: int = 10, refreshes: int = 2, latency_ms: float = 50.0,
+                  timeout: float = 120, env: Optional[dict] = None) -> dict:
+    """Chạy `sessions` phiên (tối đa `concurrency` cùng lúc) vào một server Streamlit dùng API giả."""
+    with FakeServices(latency_ms) as services:
+        server_env = {**(env or {}), **services.env()}
+        logging.info(f"Load test: {sessions} phiên, {concurrency} đồng thời, API giả {services.env()}")
+        with StreamlitServer(server_env) as server:
+            report = asyncio.run(_drive(server.url, sessions, concurrency, refreshes, timeout, server))
+        report['requests'] = dict(services.counts)
+    return report
+
+
+def format_report(report: dict) -> str:
+    memory = report['memory_per_session_mb']
+    lines = [
+        f"Phiên: {report['sessions']} ({report['failed_sessions']} lỗi) trong {report['wall_seconds']:.1f}s",
+        f"Throughput: {report['sessions_per_second']:.2f} phiên/s, {report['reruns_per_second']:.2f} rerun/s",
+        f"Bộ nhớ server: RSS {report['rss_mb'] or 0:.0f} MB, "
+        + (f"~{memory:.1f} MB/phiên" if memory is not None else "không đo được mỗi phiên"),
+        f"{'Bước':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    ]
+    for name, stats in report['steps'].items():
+        lines.append(f"{name:<10}{stats['count']:>6}{stats['p50_ms']:>10.0f}{stats['p95_ms']:>10.0f}"
+                     f"{stats['p99_ms']:>10.0f}{stats['max_ms']:>10.0f}")
+    lines.append(f"Request tới API giả: {report['requests']}")
+    lines.extend(f"Lỗi: {error}" for error in report['errors'])
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test app Streamlit với CoinGecko/Gemini/Telegram giả")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=None, help="Số phiên chạy cùng lúc (mặc định: tất cả)")
+    parser.add_argument("--refreshes", type=int, default=2, help="Số lần autorefresh mỗi phiên")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Độ trễ của API giả")
+    parser.add_argument("--coingecko-rate", type=float, default=None, help="Ghi đè COINGECKO_RATE (request/giây)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default=None, help="Ghi báo cáo JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s - %(message)s')
+    # Không ghi vào lịch sử thật, không mở cổng metrics, không chạy scheduler nền của server được test
+    env = {"HISTORY_DB": os.path.join(tempfile.mkdtemp(prefix="loadtest_"), "history.db"), "METRICS_PORT": "",
+           "RUN_SCHEDULER": "0"}
+    if args.coingecko_rate:
+        env["COINGECKO_RATE"] = str(args.coingecko_rate)
+    report = run_load_test(args.sessions, args.concurrency or args.sessions, args.refreshes, args.latency_ms,
+                           args.timeout, env)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# fetch_crypto_data lấy dữ liệu theo ngày
+BAR = '1D'
+CORR_WINDOW = 30
+SHORT_WINDOW = 7
+LONG_WINDOW = 30
+HIGH_RATIO = 1.5
+LOW_RATIO = 0.75
+REGIMES = ('Biến động thấp', 'Bình thường', 'Biến động cao')
+
+
+def _current_bar() -> pd.Timestamp:
+    """Mốc bar đang chạy (chưa đóng), theo giờ UTC như dữ liệu CoinGecko."""
+    return pd.Timestamp.now(tz='UTC').tz_localize(None).floor(BAR)
+
+
+class RollingMoments:
+    """Tổng trượt của lợi nhuận và tích chéo (k×k) trên `window` bar gần nhất, cập nhật O(k²) mỗi bar."""
+
+    def __init__(self, size: int, window: int):
+        self.window = window
+        self.buffer = np.zeros((window, size))
+        self.count = 0
+        self._pos = 0
+        self._since_resum = 0
+        self.sums = np.zeros(size)
+        self.products = np.zeros((size, size))
+
+    def push(self, values: np.ndarray) -> None:
+        if self.count == self.window:
+            old = self.buffer[self._pos]
+            self.sums -= old
+            self.products -= np.outer(old, old)
+        else:
+            self.count += 1
+        self.buffer[self._pos] = values
+        self.sums += values
+        self.products += np.outer(values, values)
+        self._pos = (self._pos + 1) % self.window
+        self._since_resum += 1
+        if self._since_resum >= self.window:
+            # Tính lại từ buffer định kỳ để sai số cộng/trừ không tích lũy
+            rows = self.buffer[:self.count]
+            self.sums = rows.sum(axis=0)
+            self.products = rows.T @ rows
+            self._since_resum = 0
+
+    def covariance(self) -> np.ndarray:
+        n = self.count
+        if n < 2:
+            return np.full(self.products.shape, np.nan)
+        return (self.products - np.outer(self.sums, self.sums) / n) / (n - 1)
+
+
+class MarketMonitor:
+    """Ma trận tương quan trượt và chế độ biến động cho cả watchlist, cập nhật tăng dần theo bar mới."""
+
+    def __init__(self, coins: list, corr_window: int = CORR_WINDOW, short_window: int = SHORT_WINDOW,
+                 long_window: int = LONG_WINDOW):
+        self.coins = list(coins)
+        self._windows = (corr_window, short_window, long_window)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Xóa toàn bộ trạng thái, lần cập nhật sau nạp lại lịch sử."""
+        corr_window, short_window, long_window = self._windows
+        with self._lock:
+            self.corr = RollingMoments(len(self.coins), corr_window)
+            self.short = RollingMoments(len(self.coins), short_window)
+            self.long = self.corr if long_window == corr_window else RollingMoments(len(self.coins), long_window)
+            self.last_ts = None
+            self.last_prices = None
+            # Snapshot mới nhất của bar đang chạy: (mốc bar, giá)
+            self._pending = None
+
+    def push(self, timestamp, prices: np.ndarray) -> None:
+        """Thêm một bar giá (theo thứ tự self.coins)."""
+        prices = np.asarray(prices, dtype=float)
+        with self._lock:
+            if self.last_prices is not None:
+                returns = np.nan_to_num(np.log(prices / self.last_prices))
+                for moments in {id(m): m for m in (self.corr, self.short, self.long)}.values():
+                    moments.push(returns)
+            # Giữ giá cũ cho coin thiếu dữ liệu ở bar này
+            self.last_prices = np.where(np.isfinite(prices), prices, self.last_prices if self.last_prices is not None else np.nan)
+            self.last_ts = pd.Timestamp(timestamp)
+
+    def update_frames(self, frames: Dict[str, pd.DataFrame]) -> int:
+        """Nạp các bar đã đóng mới hơn bar cuối đã thấy từ DataFrame giá của từng coin, trả về số bar đã thêm."""
+        series = {}
+        for coin in self.coins:
+            df = frames.get(coin)
+            if df is None or df.empty:
+                continue
+            df = df.set_index('timestamp') if 'timestamp' in df.columns else df
+            series[coin] = df['price'].resample(BAR).last()
+        if not series:
+            return 0
+        panel = pd.DataFrame(series).reindex(columns=self.coins).ffill()
+        # Bar hôm nay chưa đóng, giá cuối chỉ là giá hiện tại
+        panel = panel[panel.index < _current_bar()]
+        if self.last_ts is not None:
+            panel = panel[panel.index > self.last_ts]
+        else:
+            # Lần đầu chỉ cần đủ bar cho cửa sổ dài nhất
+            panel = panel.iloc[-(max(self.corr.window, self.long.window) + 1):]
+        for timestamp, row in zip(panel.index, panel.to_numpy()):
+            self.push(timestamp, row)
+        logging.info(f"Market monitor: thêm {len(panel)} bar, bar cuối {self.last_ts}")
+        return len(panel)
+
+    def update_prices(self, prices: Dict[str, float], timestamp=None) -> bool:
+        """Nạp snapshot giá mới nhất (fetch_latest_prices).
+
+        Snapshot cuối cùng của một bar được thêm làm giá đóng khi đã sang bar kế tiếp. Nếu bị lỡ bar
+        (không có snapshot của bar liền sau bar cuối), monitor reset để nạp lại lịch sử.
+        """
+        if not prices:
+            return False
+        bar = pd.Timestamp(timestamp).floor(BAR) if timestamp is not None else _current_bar()
+        step = pd.Timedelta(BAR)
+        pending, self._pending = self._pending, (bar, [prices.get(coin, np.nan) for coin in self.coins])
+        if pending is None or bar <= pending[0]:
+            return False
+        closed_bar, closed_prices = pending
+        if self.last_ts is not None and closed_bar <= self.last_ts:
+            return False
+        if bar != closed_bar + step or (self.last_ts is not None and closed_bar != self.last_ts + step):
+            logging.warning(f"Market monitor: lỡ bar giữa {self.last_ts} và {bar}, nạp lại lịch sử")
+            self.reset()
+            return False
+        self.push(closed_bar, closed_prices)
+        return True
+
+    def correlation(self) -> pd.DataFrame:
+        with self._lock:
+            cov = self.corr.covariance()
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.outer(std, std)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=self.coins, columns=self.coins)
+
+    def volatility(self) -> pd.DataFrame:
+        """Độ biến động ngắn/dài hạn (%/bar) và chế độ biến động theo tỷ lệ giữa hai cửa sổ."""
+        with self._lock:
+            short_vol = np.sqrt(np.diag(self.short.covariance())) * 100
+            long_vol = np.sqrt(np.diag(self.long.covariance())) * 100
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = short_vol / long_vol
+        regime = np.select([ratio > HIGH_RATIO, ratio < LOW_RATIO], [REGIMES[2], REGIMES[0]], REGIMES[1])
+        return pd.DataFrame({'short_vol': short_vol, 'long_vol': long_vol, 'ratio': ratio, 'regime': regime},
+                            index=self.coins)
+
+    @property
+    def ready(self) -> bool:
+        return len(self.coins) > 1 and self.corr.count >= 2 and self.short.count >= 2
+
+
+def top_pairs(corr: pd.DataFrame, n: int = 3) -> list:
+    """Các cặp coin tương quan mạnh nhất (theo trị tuyệt đối)."""
+    upper = corr.where(np.triu(np.ones(corr.shape, dtype=bool), k=1)).stack()
+    return [(a, b, value) for (a, b), value in upper.reindex(upper.abs().sort_values(ascending=False).index).head(n).items()]
+
+
+def format_market_overview(monitor: MarketMonitor) -> str:
+    """Tóm tắt thị trường cho Telegram: chế độ biến động từng coin và các cặp tương quan mạnh."""
+    if not monitor.ready:
+        return ""
+    vol = monitor.volatility()
+    lines = [f"*Tổng quan thị trường* ({monitor.corr.count} bar {BAR})"]
+    for coin, row in vol.iterrows():
+        lines.append(f"- {coin}: {row['regime']} (biến động {row['short_vol']:.2f}% / {row['long_vol']:.2f}%)")
+    pairs = top_pairs(monitor.correlation())
+    if pairs:
+        lines.append("Tương quan mạnh: " + ", ".join(f"{a}/{b} {value:+.2f}" for a, b, value in pairs))
+    return "\n".join(lines)
+
+
+_monitors: Dict[tuple, MarketMonitor] = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(coins: list) -> MarketMonitor:
+    """MarketMonitor dùng chung trong process cho một watchlist."""
+    key = tuple(sorted(coins))
+    with _monitors_lock:
+        if key not in _monitors:
+            _monitors[key] = MarketMonitor(list(key))
+        return _monitors[key]
+
+
+def refresh_monitor(coins: list, days: int = 30, monitor: Optional[MarketMonitor] = None) -> MarketMonitor:
+    """Lần đầu nạp lịch sử từng coin, các lần sau chỉ lấy giá mới nhất (một request cho cả watchlist)."""
+    from modules.api import fetch_crypto_data, fetch_latest_prices
+
+    monitor = monitor or get_monitor(coins)
+    if monitor.last_ts is not None:
+        monitor.update_prices(fetch_latest_prices(monitor.coins))
+    # update_prices reset monitor khi lỡ bar
+    if monitor.last_ts is None:
+        monitor.update_frames({coin: fetch_crypto_data(coin, days=days) for coin in monitor.coins})
+    return monitor
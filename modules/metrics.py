@@ -0,0 +1,219 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Optional
+
+METRICS_PATH = os.getenv("METRICS_PATH", "logs/metrics.prom")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+# Ngưỡng histogram (giây) để đặt SLO cho độ trễ báo cáo
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_stats = {}
+_server = None
+# Span đang mở của từng thread (lồng nhau thành stack)
+_active = threading.local()
+
+
+class Span:
+    """Một lần đo cho một giai đoạn (stage) của một coin."""
+
+    def __init__(self, stage: str, coin: str = ""):
+        self.stage = stage
+        self.coin = coin
+        self.status = "ok"
+        self.rows = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.duration = 0.0
+
+
+def _record(span: Span) -> None:
+    key = (span.stage, span.coin)
+    with _lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = {
+                'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0,
+                'rows': 0, 'cache_hit': 0, 'cache_miss': 0,
+                'buckets': [0] * len(BUCKETS), 'updated': 0.0
+            }
+            _stats[key] = stat
+        stat['count'] += 1
+        stat['total'] += span.duration
+        stat['last'] = span.duration
+        stat['max'] = max(stat['max'], span.duration)
+        stat['updated'] = time.time()
+        if span.status != "ok":
+            stat['errors'] += 1
+        if span.rows is not None:
+            stat['rows'] = int(span.rows)
+        stat['cache_hit'] += span.cache_hits
+        stat['cache_miss'] += span.cache_misses
+        for i, bound in enumerate(BUCKETS):
+            if span.duration <= bound:
+                stat['buckets'][i] += 1
+
+
+@contextmanager
+def span(stage: str, coin: str = ""):
+    """Đo thời gian một giai đoạn; gán rows/cache_hits/cache_misses/status trên span trả về."""
+    s = Span(stage, coin)
+    stack = getattr(_active, 'stack', None)
+    if stack is None:
+        stack = _active.stack = []
+    stack.append(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except Exception:
+        s.status = "error"
+        raise
+    finally:
+        s.duration = time.perf_counter() - start
+        stack.pop()
+        _record(s)
+        logging.debug(f"Span {stage}[{coin}]: {s.duration:.3f}s, status={s.status}, rows={s.rows}")
+
+
+def current_span() -> Optional[Span]:
+    """Span trong cùng nhất đang mở ở thread hiện tại (None nếu không có), để code bên trong báo cache hit/miss."""
+    stack = getattr(_active, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def timed(stage: str, failed: Optional[Callable[[Any], bool]] = None):
+    """Decorator đo thời gian hàm, lấy coin từ tham số `coin` nếu có.
+
+    `failed(result)` cho các hàm tự bắt lỗi và trả về giá trị rỗng: True thì span ghi status "error".
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            coin = kwargs.get('coin', "")
+            if not coin and args and isinstance(args[0], str):
+                coin = args[0]
+            with span(stage, coin) as s:
+                result = func(*args, **kwargs)
+                if failed is not None and failed(result):
+                    s.status = "error"
+                return result
+        return wrapper
+    return decorator
+
+
+def snapshot() -> list:
+    """Trả về danh sách thống kê theo (stage, coin) để hiển thị."""
+    with _lock:
+        items = [(key, dict(stat)) for key, stat in _stats.items()]
+    rows = []
+    for (stage, coin), stat in sorted(items):
+        rows.append({
+            'stage': stage,
+            'coin': coin,
+            'count': stat['count'],
+            'errors': stat['errors'],
+            'avg_s': round(stat['total'] / stat['count'], 3) if stat['count'] else 0.0,
+            'last_s': round(stat['last'], 3),
+            'max_s': round(stat['max'], 3),
+            'rows': stat['rows'],
+            'cache_hit': stat['cache_hit'],
+            'cache_miss': stat['cache_miss']
+        })
+    return rows
+
+
+def reset() -> None:
+    """Xóa toàn bộ số liệu đã ghi."""
+    with _lock:
+        _stats.clear()
+
+
+def _label(value: str) -> str:
+    """Thoát giá trị label theo định dạng Prometheus text (\\, ", xuống dòng)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    """Xuất số liệu theo định dạng Prometheus text."""
+    with _lock:
+        items = [(key, dict(stat, buckets=list(stat['buckets']))) for key, stat in _stats.items()]
+    lines = [
+        "# HELP cryptotool_stage_duration_seconds Thời gian mỗi giai đoạn phân tích",
+        "# TYPE cryptotool_stage_duration_seconds histogram"
+    ]
+    for (stage, coin), stat in sorted(items):
+        labels = f'stage="{_label(stage)}",coin="{_label(coin)}"'
+        for bound, count in zip(BUCKETS, stat['buckets']):
+            lines.append(f'cryptotool_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'cryptotool_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {stat["count"]}')
+        lines.append(f'cryptotool_stage_duration_seconds_sum{{{labels}}} {stat["total"]:.6f}')
+        lines.append(f'cryptotool_stage_duration_seconds_count{{{labels}}} {stat["count"]}')
+    for name, field, help_text in (
+        ("cryptotool_stage_errors_total", 'errors', "Số lần giai đoạn lỗi"),
+        ("cryptotool_stage_rows", 'rows', "Số hàng dữ liệu lần chạy gần nhất"),
+        ("cryptotool_cache_hits_total", 'cache_hit', "Số lần cache hit"),
+        ("cryptotool_cache_misses_total", 'cache_miss', "Số lần cache miss"),
+    ):
+        metric_type = "gauge" if field == 'rows' else "counter"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for (stage, coin), stat in sorted(items):
+            lines.append(f'{name}{{stage="{_label(stage)}",coin="{_label(coin)}"}} {stat[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path: Optional[str] = None) -> Optional[str]:
+    """Ghi số liệu ra file Prometheus text (dùng cho node_exporter textfile)."""
+    path = path or METRICS_PATH
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        logging.error(f"Lỗi ghi metrics: {str(e)}")
+        return None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[int]:
+    """Mở endpoint /metrics cục bộ (chỉ khởi động một lần mỗi process)."""
+    global _server
+    port = port if port is not None else METRICS_PORT
+    if not port:
+        return None
+    with _lock:
+        if _server is not None:
+            return _server.server_address[1]
+        try:
+            _server = HTTPServer(("127.0.0.1", port), _MetricsHandler)
+        except OSError as e:
+            logging.error(f"Không mở được metrics server cổng {port}: {str(e)}")
+            return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics server chạy tại http://127.0.0.1:{port}/metrics")
+    return port
@@ -0,0 +1,93 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PATHS = 10000
+# Số đường mô phỏng mỗi lô để giới hạn bộ nhớ (lô × số lệnh float64)
+BATCH_PATHS = 2000
+PERCENTILES = (5, 50, 95)
+
+
+def trade_returns(trades: list) -> np.ndarray:
+    """Tỷ suất lợi nhuận từng lệnh (ghép lệnh mở với lệnh đóng kế tiếp trong danh sách của run_backtest)."""
+    returns = []
+    entry_price = None
+    for trade in trades:
+        if 'entry_price' in trade:
+            entry_price = trade['entry_price']
+        elif 'exit_price' in trade and entry_price:
+            returns.append(trade['exit_price'] / entry_price - 1)
+            entry_price = None
+    return np.asarray(returns, dtype=float)
+
+
+def simulate_paths(returns: np.ndarray, n_paths: int, initial_balance: float = 10000,
+                   n_trades: Optional[int] = None, rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+    """Bootstrap danh sách lệnh: mọi đường là một mảng 2-D (đường × lệnh), trả về số dư cuối, drawdown, win rate."""
+    rng = rng or np.random.default_rng()
+    n_trades = n_trades or len(returns)
+    finals, drawdowns, win_rates = [], [], []
+    for start in range(0, n_paths, BATCH_PATHS):
+        size = min(BATCH_PATHS, n_paths - start)
+        sampled = returns[rng.integers(0, len(returns), size=(size, n_trades))]
+        equity = initial_balance * np.cumprod(1 + sampled, axis=1)
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), initial_balance)
+        finals.append(equity[:, -1])
+        drawdowns.append((1 - equity / peak).max(axis=1))
+        win_rates.append((sampled > 0).mean(axis=1) * 100)
+    return {
+        'final_balance': np.concatenate(finals),
+        'max_drawdown': np.concatenate(drawdowns),
+        'win_rate': np.concatenate(win_rates)
+    }
+
+
+def _simulate_chunk(args: tuple) -> Dict[str, np.ndarray]:
+    returns, n_paths, initial_balance, n_trades, seed_seq = args
+    return simulate_paths(returns, n_paths, initial_balance, n_trades, np.random.default_rng(seed_seq))
+
+
+def run_monte_carlo(backtest_result: Dict[str, Any], n_paths: int = DEFAULT_PATHS, initial_balance: float = 10000,
+                    workers: int = 1, seed: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Mô phỏng Monte Carlo từ kết quả run_backtest; workers > 1 chia đường cho nhiều tiến trình."""
+    logging.info(f"Monte Carlo: {n_paths} đường, {workers} tiến trình")
+    try:
+        returns = trade_returns(backtest_result.get('trades', []))
+        if len(returns) < 2:
+            logging.warning(f"Chỉ có {len(returns)} lệnh, không đủ để mô phỏng Monte Carlo")
+            return None
+        # Mỗi tiến trình có luồng ngẫu nhiên độc lập từ cùng seed gốc
+        workers = max(1, min(workers, os.cpu_count() or 1))
+        sizes = [n_paths // workers + (1 if i < n_paths % workers else 0) for i in range(workers)]
+        seeds = np.random.SeedSequence(seed).spawn(workers)
+        chunks = [(returns, size, initial_balance, len(returns), seq) for size, seq in zip(sizes, seeds) if size]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(_simulate_chunk, chunks))
+        else:
+            parts = [_simulate_chunk(chunk) for chunk in chunks]
+        paths = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+        summary = pd.DataFrame({
+            key: {
+                **{f"p{q}": float(np.percentile(values, q)) for q in PERCENTILES},
+                'mean': float(values.mean())
+            }
+            for key, values in paths.items()
+        }).T
+        result = {
+            'num_paths': n_paths,
+            'num_trades': len(returns),
+            'summary': summary,
+            'prob_loss': float((paths['final_balance'] < initial_balance).mean() * 100),
+            'paths': paths
+        }
+        logging.info(f"Kết quả Monte Carlo: {summary.to_dict()}")
+        return result
+    except Exception as e:
+        logging.error(f"Lỗi Monte Carlo: {str(e)}")
+        return None
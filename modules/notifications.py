@@ -3,6 +3,16 @@ import logging
 from typing import Optional
 import os
 
+TELEGRAM_URL = os.getenv("TELEGRAM_URL", "https://api.telegram.org")
+
+def escape_markdown(text: str) -> str:
+    """Thoát ký tự đặc biệt cho MarkdownV2."""
+    escape_chars = r'_*[]()~`>#+=|{}.!-'
+    for char in escape_chars:
+        text = text.replace(char, f'\\{char}')
+    text = text.replace('$', r'\$')
+    return text
+
 def send_telegram_message(
     token: str,
     chat_id: str,
@@ -16,20 +26,12 @@ def send_telegram_message(
         if not token or not chat_id:
             raise ValueError("Thiếu TELEGRAM_TOKEN hoặc TELEGRAM_CHAT_ID")
         
-        # Thoát ký tự đặc biệt cho MarkdownV2
-        def escape_markdown(text: str) -> str:
-            escape_chars = r'_*[]()~`>#+=|{}.!-'
-            for char in escape_chars:
-                text = text.replace(char, f'\\{char}')
-            text = text.replace('$', r'\$')
-            return text
-        
         # Tạo tin nhắn, giữ nguyên ký tự tiếng Việt
         full_message = f"{message}\n\n{signal_output}"
         full_message = escape_markdown(full_message)
         logging.info(f"Full Telegram message: {full_message}")
         
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        url = f"{TELEGRAM_URL}/bot{token}/sendMessage"
         payload = {
             "chat_id": chat_id.strip(),
             "text": full_message[:4096],
@@ -45,7 +47,7 @@ def send_telegram_message(
         if chart_path and os.path.exists(chart_path):
             logging.info(f"Gửi hình ảnh {chart_path} qua Telegram")
             with open(chart_path, 'rb') as image_file:
-                url = f"https://api.telegram.org/bot{token}/sendPhoto"
+                url = f"{TELEGRAM_URL}/bot{token}/sendPhoto"
                 caption = escape_markdown(f"Biểu đồ cho {message.split()[0]}")[:1024]
                 files = {"photo": image_file}
                 payload = {
@@ -62,6 +64,41 @@ def send_telegram_message(
         logging.error(f"Lỗi gửi Telegram: {str(e)}")
         raise
 
+def send_telegram_text(token: str, chat_id: str, text: str) -> None:
+    """Gửi một tin nhắn văn bản (đã escape MarkdownV2) tới một chat."""
+    url = f"{TELEGRAM_URL}/bot{token}/sendMessage"
+    payload = {
+        "chat_id": chat_id.strip(),
+        "text": escape_markdown(text)[:4096],
+        "parse_mode": "MarkdownV2"
+    }
+    response = requests.post(url, json=payload, timeout=10)
+    if response.status_code != 200:
+        logging.error(f"Telegram API trả về ({chat_id}): {response.text}")
+        response.raise_for_status()
+
+def send_telegram_photo(token: str, chat_id: str, photo: str, caption: str = "") -> Optional[str]:
+    """Gửi ảnh từ đường dẫn file hoặc file_id đã upload, trả về file_id để dùng lại."""
+    url = f"{TELEGRAM_URL}/bot{token}/sendPhoto"
+    payload = {
+        "chat_id": chat_id.strip(),
+        "caption": escape_markdown(caption)[:1024],
+        "parse_mode": "MarkdownV2"
+    }
+    if os.path.exists(photo):
+        with open(photo, 'rb') as image_file:
+            response = requests.post(url, files={"photo": image_file}, data=payload, timeout=10)
+    else:
+        payload["photo"] = photo
+        response = requests.post(url, data=payload, timeout=10)
+    if response.status_code != 200:
+        logging.error(f"Telegram API trả về (photo, {chat_id}): {response.text}")
+        response.raise_for_status()
+    try:
+        return response.json()["result"]["photo"][-1]["file_id"]
+    except (ValueError, KeyError, IndexError):
+        return None
+
 def test_telegram(token: str, chat_id: str) -> None:
     """Kiểm tra kết nối Telegram bằng tin nhắn test."""
     logging.info("Test Telegram")
@@ -69,7 +106,7 @@ def test_telegram(token: str, chat_id: str) -> None:
         if not token or not chat_id:
             raise ValueError("Thiếu TELEGRAM_TOKEN hoặc TELEGRAM_CHAT_ID")
         
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        url = f"{TELEGRAM_URL}/bot{token}/sendMessage"
         payload = {
             "chat_id": chat_id.strip(),
             "text": "Test message from Crypto Tool!"
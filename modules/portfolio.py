@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+WEIGHTINGS = ('equal', 'volatility')
+
+
+def build_panels(frames: Dict[str, pd.DataFrame]) -> tuple:
+    """Ghép DataFrame từng coin (có cột price, signal) thành hai panel thời gian × coin."""
+    prices = pd.DataFrame({coin: df['price'] for coin, df in frames.items()}).sort_index()
+    signals = pd.DataFrame({coin: df['signal'] for coin, df in frames.items()}).reindex(prices.index)
+    prices = prices.ffill()
+    signals = signals.fillna('Hold')
+    return prices, signals
+
+
+def position_panel(signals: pd.DataFrame) -> pd.DataFrame:
+    """Long mở vị thế, Short đóng vị thế, Hold giữ nguyên (giống run_backtest, chỉ long)."""
+    state = signals.apply(lambda col: col.map({'Long': 1.0, 'Short': 0.0})).astype(float)
+    return state.ffill().fillna(0.0)
+
+
+def target_weights(positions: pd.DataFrame, prices: pd.DataFrame, weighting: str = 'equal',
+                   vol_window: int = 20) -> pd.DataFrame:
+    """Tỉ trọng mục tiêu mỗi bar: chia vốn cho các coin đang giữ, đều nhau hoặc nghịch đảo biến động."""
+    active = positions.to_numpy(dtype=float)
+    if weighting == 'volatility':
+        vol = prices.pct_change().rolling(vol_window, min_periods=2).std().to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw = np.where(vol > 0, active / vol, 0.0)
+        raw = np.nan_to_num(raw)
+    elif weighting == 'equal':
+        raw = active
+    else:
+        raise ValueError(f"Cách phân bổ không hợp lệ: {weighting}")
+    total = raw.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(total > 0, raw / total, 0.0)
+    return pd.DataFrame(weights, index=positions.index, columns=positions.columns)
+
+
+def run_portfolio_backtest(prices: pd.DataFrame, signals: pd.DataFrame, initial_balance: float = 10000,
+                           weighting: str = 'equal', fee: float = 0.001, slippage: float = 0.0005,
+                           vol_window: int = 20) -> Optional[Dict[str, Any]]:
+    """Backtest danh mục nhiều coin dùng chung vốn, tính bằng phép toán ma trận trên panel thời gian × coin."""
+    logging.info(f"Bắt đầu portfolio backtest: {list(prices.columns)}, weighting={weighting}")
+    try:
+        if prices.empty or len(prices) < 5:
+            logging.warning(f"Dữ liệu quá ít ({len(prices)} hàng) để backtest danh mục")
+            return None
+
+        weights = target_weights(position_panel(signals), prices, weighting, vol_window).to_numpy()
+        price_arr = prices.to_numpy(dtype=float)
+        returns = np.zeros_like(price_arr)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[1:] = price_arr[1:] / price_arr[:-1] - 1
+        returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+        # Tỉ trọng quyết định tại bar t được giữ trong bar t+1 (tránh nhìn trước)
+        held = np.zeros_like(weights)
+        held[1:] = weights[:-1]
+        gross_returns = (held * returns).sum(axis=1)
+        # Tỉ trọng trôi theo giá trong bar, phí tính trên phần chênh so với tỉ trọng đã trôi
+        drifted = held * (1 + returns) / (1 + gross_returns)[:, None]
+        trades = np.abs(weights - drifted)
+        costs = trades * (fee + slippage)
+
+        growth = (1 + gross_returns) * (1 - costs.sum(axis=1))
+        equity = initial_balance * np.cumprod(growth)
+        drawdown = equity / np.maximum.accumulate(equity) - 1
+        prev_equity = np.concatenate([[initial_balance], equity[:-1]])
+        # Lãi/lỗ và phí theo USD cho từng coin: tổng net_pnl đúng bằng total_profit
+        pnl = held * returns * prev_equity[:, None]
+        cost_usd = costs * (prev_equity * (1 + gross_returns))[:, None]
+
+        attribution = pd.DataFrame({
+            'pnl': pnl.sum(axis=0),
+            'costs': cost_usd.sum(axis=0),
+            'avg_weight': held.mean(axis=0),
+            'num_entries': ((held == 0) & (weights > 0)).sum(axis=0)
+        }, index=prices.columns)
+        attribution['net_pnl'] = attribution['pnl'] - attribution['costs']
+
+        final_balance = float(equity[-1])
+        result = {
+            'total_profit': final_balance - initial_balance,
+            'final_balance': final_balance,
+            'total_return': final_balance / initial_balance - 1,
+            'max_drawdown': float(drawdown.min()),
+            'total_costs': float(cost_usd.sum()),
+            'turnover': float(trades.sum()),
+            'equity': pd.Series(equity, index=prices.index, name='equity'),
+            'drawdown': pd.Series(drawdown, index=prices.index, name='drawdown'),
+            'weights': pd.DataFrame(held, index=prices.index, columns=prices.columns),
+            'attribution': attribution
+        }
+        logging.info(f"Kết quả portfolio backtest: profit={result['total_profit']:.2f}, max_drawdown={result['max_drawdown']:.4f}")
+        return result
+    except Exception as e:
+        logging.error(f"Lỗi portfolio backtest: {str(e)}")
+        return None
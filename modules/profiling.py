@@ -0,0 +1,123 @@
+import cProfile
+import logging
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+PROFILE_DIR = "logs/profiles"
+PROFILE_ENABLED = os.getenv("CRYPTO_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+def _func_label(func: tuple) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{lineno}:{name}"
+
+
+def collapse_stacks(stats: pstats.Stats, max_depth: int = 64) -> list:
+    """Dựng collapsed stack (định dạng flamegraph.pl) từ đồ thị gọi của cProfile."""
+    callees = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge))
+
+    lines = {}
+
+    def walk(func, stack, scale):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        stack = stack + [_func_label(func)]
+        self_us = int(tt * scale * 1e6)
+        if self_us > 0:
+            key = ";".join(stack)
+            lines[key] = lines.get(key, 0) + self_us
+        if len(stack) >= max_depth:
+            return
+        for child, edge in callees.get(func, []):
+            if _func_label(child) in stack:
+                continue
+            child_ct = stats.stats[child][3]
+            if child_ct <= 0 or edge[3] * scale < 1e-6:
+                continue
+            # Phân bổ thời gian của hàm con theo tỉ lệ cạnh gọi
+            walk(child, stack, scale * edge[3] / child_ct)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return [f"{key} {value}" for key, value in sorted(lines.items())]
+
+
+def top_hotspots(stats: pstats.Stats, top_n: int = 15) -> list:
+    """Lấy top-N hàm tốn thời gian nhất (theo cumtime)."""
+    rows = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({
+            'function': _func_label(func),
+            'calls': nc,
+            'tottime_s': round(tt, 4),
+            'cumtime_s': round(ct, 4)
+        })
+    rows.sort(key=lambda r: r['cumtime_s'], reverse=True)
+    return rows[:top_n]
+
+
+def profile_call(func: Callable, *args, tag: str = "run", top_n: int = 15, **kwargs) -> tuple:
+    """Chạy func dưới cProfile + tracemalloc, ghi file vào logs/profiles/.
+
+    Trả về (kết quả, thông tin profile); thông tin là None nếu ghi profile lỗi.
+    """
+    info = None
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base = os.path.join(PROFILE_DIR, f"{tag}_{timestamp}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        result = profiler.runcall(func, *args, **kwargs)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+    try:
+        profiler.dump_stats(f"{base}.prof")
+        stats = pstats.Stats(profiler)
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            f.write("\n".join(collapse_stacks(stats)) + "\n")
+        allocations = snapshot.statistics("lineno")[:top_n]
+        with open(f"{base}_alloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"current={current} peak={peak}\n")
+            for stat in allocations:
+                f.write(f"{stat}\n")
+        info = {
+            'tag': tag,
+            'path': base,
+            'peak_mb': round(peak / 1024 / 1024, 2),
+            'hotspots': top_hotspots(stats, top_n),
+            'allocations': [str(stat) for stat in allocations]
+        }
+        logging.info(f"Lưu profile tại {base}.prof, peak bộ nhớ {peak} bytes")
+    except Exception as e:
+        logging.error(f"Lỗi ghi profile {tag}: {str(e)}")
+    return result, info
+
+
+def profile_run(func: Callable, *args, enabled: Optional[bool] = None, tag: str = "run", **kwargs) -> tuple:
+    """Như maybe_profile nhưng trả về (kết quả, thông tin profile của chính lần gọi này hoặc None)."""
+    if not (PROFILE_ENABLED if enabled is None else enabled):
+        return func(*args, **kwargs), None
+    return profile_call(func, *args, tag=tag, **kwargs)
+
+
+def maybe_profile(func: Callable, *args, enabled: Optional[bool] = None, tag: str = "run", **kwargs) -> Any:
+    """Gọi thẳng func nếu không bật profile (không tốn thêm chi phí)."""
+    return profile_run(func, *args, enabled=enabled, tag=tag, **kwargs)[0]
@@ -1,11 +1,17 @@
 import schedule
 import time
 import logging
-from datetime import datetime
-from modules.notifications import send_telegram_message
+from modules.alerts import get_engine, notify_alerts
+from modules.subscribers import load_subscribers, schedule_times, plan_tick, run_subscriber_tick
 import toml
+import os
+import threading
 from pathlib import Path
 
+SCHEDULER_ENABLED = os.getenv("RUN_SCHEDULER", "1") != "0"
+_runner = None
+_runner_lock = threading.Lock()
+
 # Đọc secrets từ secrets.toml
 secrets_path = Path("config/secrets.toml")
 if secrets_path.exists():
@@ -41,39 +47,61 @@ def save_schedule_config(config):
     except Exception as e:
         logging.error(f"Lỗi lưu schedule_config: {str(e)}")
 
-def auto_send_telegram(coin: str):
-    """Gửi Telegram tự động."""
-    logging.info(f"Tự động phân tích {coin} lúc {datetime.now()}")
+def check_price_alerts():
+    """Lấy giá hiện tại cho các coin có cảnh báo và gửi cảnh báo vừa kích hoạt."""
     try:
-        from modules.analysis import analyze_crypto
-        crypto_data, fib_levels, signal_output, message, chart_path = analyze_crypto(coin)
-        if message and signal_output:
-            send_telegram_message(
-                TELEGRAM_TOKEN,
-                TELEGRAM_CHAT_ID,
-                message,
-                signal_output,
-                chart_path
-            )
-            logging.info(f"Tự động gửi Telegram cho {coin} thành công")
-        else:
-            logging.error(f"Lỗi tự động gửi Telegram cho {coin}: Không có tín hiệu")
+        from modules.api import fetch_latest_prices
+        engine = get_engine()
+        coins = sorted({alert['coin'] for alert in engine.alerts()})
+        if not coins:
+            return
+        fired = []
+        for coin, price in fetch_latest_prices(coins).items():
+            fired.extend(engine.update(coin, price=price))
+        notify_alerts(fired, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)
     except Exception as e:
-        logging.error(f"Lỗi auto_send_telegram cho {coin}: {str(e)}")
+        logging.error(f"Lỗi check_price_alerts: {str(e)}")
 
 def run_scheduled_tasks():
     """Thiết lập và chạy các tác vụ đã lên lịch."""
     logging.info("Thiết lập scheduler")
     try:
         schedule.clear()
-        config = load_schedule_config()
-        for item in config:
-            time_str = item.get("time")
-            coin = item.get("coin", "BTC")
-            schedule.every().day.at(time_str).do(auto_send_telegram, coin=coin)
-            logging.info(f"Đã lên lịch cho {coin} lúc {time_str}")
-        
-        schedule.run_all()  # Chạy ngay các tác vụ nếu đến giờ
-        logging.info("Chạy tất cả tác vụ đã lên lịch")
+        # Mỗi khung giờ một tác vụ: phân tích mỗi coin một lần rồi gửi tới mọi subscriber
+        subscribers = load_subscribers(TELEGRAM_CHAT_ID)
+        for time_str in schedule_times(subscribers):
+            schedule.every().day.at(time_str).do(
+                run_subscriber_tick, time_str=time_str, token=TELEGRAM_TOKEN, default_chat_id=TELEGRAM_CHAT_ID
+            )
+            logging.info(f"Đã lên lịch lúc {time_str} cho {len(plan_tick(subscribers, time_str))} coin")
+        schedule.every(1).minutes.do(check_price_alerts)
+        logging.info(f"Đã thiết lập {len(schedule.get_jobs())} tác vụ")
     except Exception as e:
-        logging.error(f"Lỗi thiết lập scheduler: {str(e)}")
\ No newline at end of file
+        logging.error(f"Lỗi thiết lập scheduler: {str(e)}")
+
+def run_pending_forever(interval: float = 1.0):
+    """Vòng lặp chạy các tác vụ đến giờ; lỗi một tác vụ không dừng vòng lặp."""
+    while True:
+        try:
+            schedule.run_pending()
+        except Exception as e:
+            logging.error(f"Lỗi chạy tác vụ theo lịch: {str(e)}")
+        time.sleep(interval)
+
+def start_scheduler() -> bool:
+    """Thiết lập lịch và chạy trong thread nền, chỉ một lần mỗi process (Streamlit chạy lại main mỗi lần rerun)."""
+    global _runner
+    with _runner_lock:
+        if _runner is not None or not SCHEDULER_ENABLED:
+            return False
+        run_scheduled_tasks()
+        _runner = threading.Thread(target=run_pending_forever, name="scheduler", daemon=True)
+        _runner.start()
+    logging.info("Scheduler chạy nền")
+    return True
+
+if __name__ == "__main__":
+    # Chạy scheduler riêng (đặt RUN_SCHEDULER=0 cho app Streamlit để không gửi trùng)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s - %(message)s')
+    run_scheduled_tasks()
+    run_pending_forever()
\ No newline at end of file
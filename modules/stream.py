@@ -0,0 +1,229 @@
+import argparse
+import csv
+import json
+import logging
+import queue
+import threading
+from collections import deque
+from typing import Callable, Iterable, Iterator, Optional
+
+import pandas as pd
+
+TIMEFRAMES = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+DEFAULT_MAXLEN = 1000
+SIGNAL_QUEUE_SIZE = 100
+
+
+class BarAggregator:
+    """Gộp trade/ticker thành nến OHLCV nhiều khung thời gian trong một lượt, lưu bằng ring buffer."""
+
+    def __init__(self, coin: str, timeframes: Optional[list] = None, maxlen: int = DEFAULT_MAXLEN):
+        self.coin = coin
+        self.timeframes = {tf: TIMEFRAMES[tf] for tf in (timeframes or list(TIMEFRAMES))}
+        self.bars = {tf: deque(maxlen=maxlen) for tf in self.timeframes}
+        self._current = {tf: None for tf in self.timeframes}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.late_trades = 0
+
+    def subscribe(self, callback: Callable[[str, str, dict], None]) -> None:
+        """Đăng ký callback(coin, timeframe, bar) nhận nến vừa đóng."""
+        self._subscribers.append(callback)
+
+    def _publish(self, timeframe: str, bar: dict) -> None:
+        for callback in self._subscribers:
+            try:
+                callback(self.coin, timeframe, bar)
+            except Exception as e:
+                logging.error(f"Lỗi subscriber nến {self.coin} {timeframe}: {str(e)}")
+
+    def add_trade(self, timestamp: float, price: float, qty: float = 0.0) -> list:
+        """Thêm một trade (timestamp giây), trả về các (timeframe, bar) vừa đóng."""
+        closed = []
+        with self._lock:
+            for tf, seconds in self.timeframes.items():
+                start = int(timestamp // seconds * seconds)
+                bar = self._current[tf]
+                if bar is not None and start < bar['start']:
+                    # Trade đến trễ thuộc nến đã đóng, bỏ qua
+                    self.late_trades += 1
+                    continue
+                if bar is None or start != bar['start']:
+                    if bar is not None:
+                        self.bars[tf].append(bar)
+                        closed.append((tf, bar))
+                    self._current[tf] = {
+                        'start': start, 'open': price, 'high': price,
+                        'low': price, 'close': price, 'volume': qty, 'trades': 1
+                    }
+                    continue
+                if price > bar['high']:
+                    bar['high'] = price
+                if price < bar['low']:
+                    bar['low'] = price
+                bar['close'] = price
+                bar['volume'] += qty
+                bar['trades'] += 1
+        for tf, bar in closed:
+            self._publish(tf, bar)
+        return closed
+
+    def flush(self) -> list:
+        """Đóng các nến đang mở (dùng khi hết file replay)."""
+        closed = []
+        with self._lock:
+            for tf, bar in self._current.items():
+                if bar is not None:
+                    self.bars[tf].append(bar)
+                    closed.append((tf, bar))
+                    self._current[tf] = None
+        for tf, bar in closed:
+            self._publish(tf, bar)
+        return closed
+
+    def frame(self, timeframe: str) -> pd.DataFrame:
+        """Các nến đã đóng dạng DataFrame, cùng cột với fetch_crypto_data (price = close)."""
+        with self._lock:
+            bars = list(self.bars[timeframe])
+        if not bars:
+            return pd.DataFrame()
+        df = pd.DataFrame(bars)
+        df['timestamp'] = pd.to_datetime(df['start'], unit='s')
+        df = df.rename(columns={'close': 'price'}).set_index('timestamp')
+        return df[['price', 'high', 'low', 'open', 'volume']]
+
+
+class SignalWorker:
+    """Tính chỉ báo, tín hiệu và gửi cảnh báo trên thread riêng để callback nhận trade không bị chặn."""
+
+    def __init__(self, aggregator: BarAggregator, timeframe: str = '1m', min_bars: int = 30,
+                 on_signal: Optional[Callable[[str, str, pd.Series], None]] = None, maxsize: int = SIGNAL_QUEUE_SIZE):
+        self.aggregator = aggregator
+        self.timeframe = timeframe
+        self.min_bars = min_bars
+        self.on_signal = on_signal
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f"signals-{aggregator.coin}", daemon=True)
+        self._thread.start()
+
+    def __call__(self, coin: str, tf: str, bar: dict) -> None:
+        """Subscriber của aggregator: chỉ xếp hàng nến vừa đóng, không tính toán tại đây."""
+        if tf != self.timeframe:
+            return
+        try:
+            self.queue.put_nowait((coin, tf, bar))
+        except queue.Full:
+            # Worker chậm hơn luồng nến: bỏ nến cũ nhất, tín hiệu luôn tính trên frame mới nhất
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            self.queue.put_nowait((coin, tf, bar))
+
+    def _run(self) -> None:
+        from modules.analysis import calculate_fibonacci_levels, calculate_indicators, compute_signals, SIGNAL_INDICATORS
+        from modules.alerts import get_engine, notify_alerts
+        from modules.api import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
+
+        while True:
+            coin, tf, bar = self.queue.get()
+            try:
+                df = self.aggregator.frame(tf)
+                if len(df) < self.min_bars:
+                    continue
+                df = calculate_indicators(df, SIGNAL_INDICATORS)
+                df = compute_signals(df, calculate_fibonacci_levels(df))
+                latest = df.iloc[-1]
+                fired = get_engine().update(coin, price=latest['price'], rsi=latest['rsi'])
+                notify_alerts(fired, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID)
+                logging.info(f"Nến {coin} {tf} đóng: giá {latest['price']}, tín hiệu {latest['signal']}")
+                if self.on_signal:
+                    self.on_signal(coin, tf, latest)
+            except Exception as e:
+                logging.error(f"Lỗi tính tín hiệu {coin} {tf}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def drain(self) -> None:
+        """Chờ xử lý hết các nến đang xếp hàng (dùng khi replay)."""
+        self.queue.join()
+
+
+def make_signal_handler(aggregator: BarAggregator, timeframe: str = '1m', min_bars: int = 30,
+                        on_signal: Optional[Callable[[str, str, pd.Series], None]] = None) -> SignalWorker:
+    """Đăng ký SignalWorker tính chỉ báo + tín hiệu mỗi khi nến `timeframe` đóng, đồng thời cập nhật cảnh báo."""
+    worker = SignalWorker(aggregator, timeframe, min_bars, on_signal)
+    aggregator.subscribe(worker)
+    return worker
+
+
+def replay_trades(path: str) -> Iterator[tuple]:
+    """Đọc trade từ file replay (CSV timestamp,price,qty hoặc JSONL {"T","p","q"}), timestamp giây hoặc ms."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in f if line.strip())
+            rows = ((row.get("T", row.get("timestamp")), row.get("p", row.get("price")), row.get("q", row.get("qty", 0))) for row in rows)
+        else:
+            reader = csv.reader(f)
+            rows = (row for row in reader if row and not row[0].startswith(("#", "timestamp")))
+        for timestamp, price, qty in rows:
+            timestamp = float(timestamp)
+            if timestamp > 1e11:
+                timestamp /= 1000.0
+            yield timestamp, float(price), float(qty or 0)
+
+
+def run_replay(aggregator: BarAggregator, trades: Iterable[tuple]) -> int:
+    """Đẩy toàn bộ trade vào aggregator, trả về số trade đã xử lý."""
+    count = 0
+    for timestamp, price, qty in trades:
+        aggregator.add_trade(timestamp, price, qty)
+        count += 1
+    aggregator.flush()
+    logging.info(f"Replay {aggregator.coin}: {count} trade, {aggregator.late_trades} trade trễ")
+    return count
+
+
+def start_binance_stream(aggregator: BarAggregator, symbol: Optional[str] = None):
+    """Nhận trade realtime từ WebSocket Binance, trả về ThreadedWebsocketManager để dừng khi cần."""
+    from binance import ThreadedWebsocketManager
+
+    symbol = symbol or f"{aggregator.coin.upper()}USDT"
+
+    def on_message(msg: dict) -> None:
+        if msg.get('e') == 'error':
+            logging.error(f"Lỗi WebSocket {symbol}: {msg}")
+            return
+        aggregator.add_trade(msg['T'] / 1000.0, float(msg['p']), float(msg['q']))
+
+    manager = ThreadedWebsocketManager()
+    manager.start()
+    manager.start_trade_socket(callback=on_message, symbol=symbol)
+    logging.info(f"Bắt đầu stream trade {symbol}")
+    return manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gộp trade thành nến OHLCV nhiều khung thời gian")
+    parser.add_argument("--coin", default="BTC")
+    parser.add_argument("--replay", help="File replay CSV/JSONL thay cho WebSocket")
+    parser.add_argument("--timeframe", default="1m", choices=list(TIMEFRAMES))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s - %(message)s')
+    aggregator = BarAggregator(args.coin)
+    worker = make_signal_handler(aggregator, args.timeframe)
+    if args.replay:
+        run_replay(aggregator, replay_trades(args.replay))
+        worker.drain()
+        print(aggregator.frame(args.timeframe).tail())
+    else:
+        manager = start_binance_stream(aggregator)
+        manager.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import toml
+
+from modules.market import get_monitor, format_market_overview
+from modules.metrics import span, export_prometheus
+from modules.notifications import send_telegram_text, send_telegram_photo
+from modules.profiling import maybe_profile
+from modules.ratelimit import RateLimiter
+
+SUBSCRIBERS_PATH = Path("config/subscribers.toml")
+FORMATS = ('full', 'short')
+
+# Giới hạn Telegram: ~30 tin/giây toàn bot, ~1 tin/giây mỗi chat
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+SEND_WORKERS = 4
+# Số lần thử lại khi Telegram trả 429 (retry_after)
+MAX_RETRIES = 3
+
+
+def load_subscribers(default_chat_id: str = "") -> list:
+    """Load danh sách subscriber; nếu chưa có file thì chuyển từ schedule_config cũ (một chat)."""
+    logging.info("Load subscribers")
+    try:
+        if SUBSCRIBERS_PATH.exists():
+            with open(SUBSCRIBERS_PATH, "r") as f:
+                subscribers = toml.load(f).get("subscribers", [])
+        else:
+            from modules.scheduler import load_schedule_config
+            subscribers = [
+                {'chat_id': default_chat_id, 'coins': [item.get("coin", "BTC")], 'times': [item.get("time")]}
+                for item in load_schedule_config() if item.get("time")
+            ]
+        for sub in subscribers:
+            sub.setdefault('coins', ["BTC"])
+            sub.setdefault('times', [])
+            sub.setdefault('format', 'full')
+            sub.setdefault('chart', True)
+        return [sub for sub in subscribers if sub.get('chat_id')]
+    except Exception as e:
+        logging.error(f"Lỗi load subscribers: {str(e)}")
+        return []
+
+
+def save_subscribers(subscribers: list) -> None:
+    """Lưu danh sách subscriber vào subscribers.toml."""
+    logging.info("Lưu subscribers")
+    try:
+        SUBSCRIBERS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(SUBSCRIBERS_PATH, "w") as f:
+            toml.dump({"subscribers": subscribers}, f)
+        logging.info("Lưu subscribers thành công")
+    except Exception as e:
+        logging.error(f"Lỗi lưu subscribers: {str(e)}")
+
+
+def schedule_times(subscribers: list) -> list:
+    """Các khung giờ khác nhau của tất cả subscriber."""
+    return sorted({t for sub in subscribers for t in sub['times']})
+
+
+def plan_tick(subscribers: list, time_str: str) -> dict:
+    """Nhóm subscriber theo coin cho một khung giờ: {coin: [subscriber, ...]}."""
+    plan = {}
+    for sub in subscribers:
+        if time_str not in sub['times']:
+            continue
+        for coin in sub['coins']:
+            plan.setdefault(coin, []).append(sub)
+    return plan
+
+
+def render_message(message: str, signal_output: str, fmt: str) -> str:
+    """Tạo nội dung tin nhắn theo định dạng (full: kèm phân tích + AI, short: chỉ tóm tắt)."""
+    if fmt == 'short':
+        return message
+    return f"{message}\n\n{signal_output}"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Số giây Telegram yêu cầu chờ nếu lỗi là 429 Too Many Requests, None nếu là lỗi khác."""
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 429:
+        return None
+    try:
+        return float(response.json()['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        return float(response.headers.get('Retry-After', 1))
+
+
+class FanOutSender:
+    """Gửi tin tới nhiều chat với giới hạn tốc độ chung và theo từng chat; ảnh chỉ upload một lần."""
+
+    def __init__(self, token: str, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 workers: int = SEND_WORKERS):
+        self.token = token
+        self.limiter = RateLimiter(rate, burst=int(rate))
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self._file_ids = {}
+        self._file_lock = threading.Lock()
+
+    def _send_photo(self, chat_id: str, chart_path: str, caption: str) -> None:
+        with self._file_lock:
+            file_id = self._file_ids.get(chart_path)
+            if file_id is None:
+                # Upload lần đầu trong lock để các chat khác dùng lại file_id
+                self.limiter.acquire()
+                file_id = send_telegram_photo(self.token, chat_id, chart_path, caption)
+                if file_id:
+                    self._file_ids[chart_path] = file_id
+                return
+        self.limiter.acquire()
+        send_telegram_photo(self.token, chat_id, file_id, caption)
+
+    def _send(self, func, *args):
+        """Gửi, chờ theo retry_after và thử lại khi bị Telegram giới hạn tốc độ."""
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is None or attempt == MAX_RETRIES:
+                    raise
+                logging.warning(f"Telegram 429, chờ {wait}s rồi gửi lại (lần {attempt + 1})")
+                time.sleep(wait)
+
+    def _deliver_chat(self, chat_id: str, items: list) -> int:
+        sent = 0
+        last = 0.0
+        for text, chart_path, caption in items:
+            try:
+                for kind in ('text', 'photo'):
+                    if kind == 'photo' and not chart_path:
+                        continue
+                    wait = self.per_chat_interval - (time.monotonic() - last)
+                    if wait > 0:
+                        time.sleep(wait)
+                    if kind == 'text':
+                        self.limiter.acquire()
+                        self._send(send_telegram_text, self.token, chat_id, text)
+                    else:
+                        self._send(self._send_photo, chat_id, chart_path, caption)
+                    last = time.monotonic()
+                sent += 1
+            except Exception as e:
+                logging.error(f"Lỗi gửi tới chat {chat_id}: {str(e)}")
+        return sent
+
+    def deliver(self, outbox: dict) -> int:
+        """Gửi outbox {chat_id: [(text, chart_path, caption), ...]}, trả về số tin gửi thành công."""
+        if not outbox:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._deliver_chat, chat_id, items) for chat_id, items in outbox.items()]
+            return sum(future.result() for future in futures)
+
+
+def market_overview(frames: dict) -> str:
+    """Cập nhật MarketMonitor của watchlist bằng dữ liệu vừa phân tích, trả về tóm tắt (rỗng nếu < 2 coin)."""
+    if len(frames) < 2:
+        return ""
+    try:
+        monitor = get_monitor(list(frames))
+        monitor.update_frames(frames)
+        return format_market_overview(monitor)
+    except Exception as e:
+        logging.error(f"Lỗi tổng quan thị trường: {str(e)}")
+        return ""
+
+
+def run_subscriber_tick(time_str: str, token: Optional[str] = None, default_chat_id: str = "",
+                        subscribers: Optional[list] = None, analyze=None) -> int:
+    """Mỗi coin chỉ phân tích một lần, render một lần mỗi định dạng, rồi gửi tới mọi chat đăng ký."""
+    logging.info(f"Subscriber tick {time_str} lúc {datetime.now()}")
+    if analyze is None:
+        from modules.analysis import analyze_crypto as analyze
+    subscribers = subscribers if subscribers is not None else load_subscribers(default_chat_id)
+    plan = plan_tick(subscribers, time_str)
+    outbox = {}
+    frames = {}
+    with span("subscriber_tick", time_str) as s:
+        for coin, subs in plan.items():
+            crypto_data, fib_levels, signal_output, message, chart_path = maybe_profile(analyze, coin, interactive=False, tag=f"scheduled_{coin}")
+            if crypto_data is not None:
+                frames[coin] = crypto_data
+            if not message or not signal_output:
+                logging.error(f"Không có tín hiệu cho {coin}, bỏ qua {len(subs)} subscriber")
+                continue
+            rendered = {fmt: render_message(message, signal_output, fmt) for fmt in {sub['format'] for sub in subs}}
+            caption = f"Biểu đồ cho {coin}"
+            for sub in subs:
+                outbox.setdefault(sub['chat_id'], []).append(
+                    (rendered[sub['format']], chart_path if sub['chart'] else None, caption)
+                )
+        # Tổng quan thị trường (tương quan + chế độ biến động) cho các coin của tick, gửi một lần mỗi chat
+        overview = market_overview(frames)
+        if overview:
+            for items in outbox.values():
+                items.append((overview, None, None))
+        sent = FanOutSender(token).deliver(outbox)
+        s.rows = sent
+    logging.info(f"Tick {time_str}: {len(plan)} coin, {len(outbox)} chat, {sent} tin đã gửi")
+    export_prometheus()
+    return sent
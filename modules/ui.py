@@ -2,13 +2,60 @@ import streamlit as st
 import pandas as pd
 import logging
 from datetime import datetime, time
-from modules.analysis import analyze_crypto
+from modules.analysis import analyze_crypto, calculate_fibonacci_levels, calculate_indicators, compute_signals, upgrade_recommendation, SIGNAL_INDICATORS
 from modules.backtest import run_backtest
 from modules.notifications import test_telegram
 from modules.api import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
+from modules.metrics import snapshot, export_prometheus
+from modules import profiling
+from modules.archive import open_archive, list_archived_coins
+from modules.alerts import get_engine, save_alerts, ALERT_KINDS
+from modules.market import get_monitor, refresh_monitor
+from modules.montecarlo import run_monte_carlo
+from modules.portfolio import build_panels, run_portfolio_backtest, WEIGHTINGS
+from modules.api import fetch_crypto_data
+from modules.charts import prepare_chart_data, build_interactive_chart
+from modules.history import query_signals, signal_accuracy, recent_runs
 import os
+from typing import Optional
 from streamlit_autorefresh import st_autorefresh
 
+def show_chart(result: tuple, coin: str, interactive: bool) -> None:
+    """Hiển thị biểu đồ: tương tác (LTTB + Altair trên trình duyệt) hoặc ảnh PNG."""
+    crypto_data, fib_levels, _, _, chart_path = result
+    if interactive:
+        # Chỉ giảm điểm một lần cho mỗi kết quả, các lần rerun dùng lại
+        cache = st.session_state.get('chart_data_cache')
+        if not cache or cache[0] is not crypto_data:
+            cache = (crypto_data, prepare_chart_data(crypto_data))
+            st.session_state.chart_data_cache = cache
+        st.altair_chart(build_interactive_chart(cache[1], fib_levels, coin), use_container_width=True)
+    elif chart_path and os.path.exists(chart_path):
+        st.image(chart_path, caption=f"{coin} Chart")
+    else:
+        st.warning(f"Không tìm thấy biểu đồ cho {coin}. Kiểm tra log để biết thêm chi tiết.")
+        logging.warning(f"No chart at {chart_path}")
+
+def show_monte_carlo(backtest_result: dict, n_paths: int) -> None:
+    """Khoảng tin cậy Monte Carlo (p5/p50/p95) cho số dư cuối, drawdown và win rate."""
+    if not n_paths:
+        return
+    with st.spinner(f"Monte Carlo {n_paths} đường..."):
+        mc_result = run_monte_carlo(backtest_result, n_paths=n_paths, workers=int(os.getenv("MONTE_CARLO_WORKERS", "1")))
+    if not mc_result:
+        st.info("Không đủ lệnh để chạy Monte Carlo")
+        return
+    st.write(f"Monte Carlo ({mc_result['num_paths']} đường × {mc_result['num_trades']} lệnh) - xác suất lỗ: {mc_result['prob_loss']:.1f}%")
+    summary = mc_result['summary'].rename(index={'final_balance': 'Final Balance ($)', 'max_drawdown': 'Max Drawdown (%)', 'win_rate': 'Win Rate (%)'})
+    summary.loc['Max Drawdown (%)'] *= 100
+    st.dataframe(summary.style.format("{:,.2f}"))
+
+def show_profile_status(profile_info: Optional[dict]) -> None:
+    """Lưu profile của lần chạy vừa rồi vào session; ghi lỗi thì xóa profile cũ thay vì hiển thị nhầm."""
+    st.session_state.last_profile = profile_info
+    if profile_info is None:
+        st.warning("Không ghi được profile cho lần chạy này")
+
 def ui():
     """Render UI for CryptoTool."""
     logging.info("Rendering UI")
@@ -73,7 +120,8 @@ def ui():
         for sched_time in scheduled_times:
             if now.hour == sched_time.hour and now.minute == sched_time.minute:
                 logging.info(f"Chạy phân tích theo lịch cho {coin} tại {sched_time}")
-                result = analyze_crypto(coin, days=days)
+                result = analyze_crypto(coin, days=days, interactive=False,
+                                        send_telegram=st.session_state.get('send_telegram', False))
                 crypto_data, fib_levels, signal_output, message, chart_path = result
                 if crypto_data is not None and not crypto_data.empty:
                     st.session_state.analysis_result = result
@@ -82,6 +130,50 @@ def ui():
                 else:
                     logging.error(f"Phân tích theo lịch {coin} thất bại: Empty data")
     
+    # Cảnh báo giá / chỉ báo
+    with st.sidebar.expander("Cảnh báo"):
+        engine = get_engine()
+        alert_kind = st.selectbox("Loại", list(ALERT_KINDS), key="alert_kind")
+        alert_threshold = st.number_input("Ngưỡng", value=0.0, format="%.4f", key="alert_threshold")
+        alert_cooldown = st.number_input("Cooldown (giây)", value=300, min_value=0, key="alert_cooldown")
+        if st.button("Thêm cảnh báo", key="add_alert"):
+            engine.add(coin, alert_kind, alert_threshold, cooldown=alert_cooldown)
+            save_alerts(engine)
+            logging.info(f"Thêm cảnh báo {alert_kind} {alert_threshold} cho {coin}")
+        if st.button("Cảnh báo gần các mức Fib", key="add_fib_alerts"):
+            analysis_result = st.session_state.get('analysis_result')
+            if analysis_result and analysis_result[1] and st.session_state.get('analyzed_coin') == coin:
+                engine.add_fib_alerts(coin, analysis_result[1], cooldown=alert_cooldown)
+                save_alerts(engine)
+                logging.info(f"Thêm cảnh báo Fib cho {coin}")
+            else:
+                st.info(f"Chạy phân tích {coin} trước để có các mức Fib")
+        coin_alerts = [alert for alert in engine.alerts() if alert['coin'] == coin]
+        for alert in coin_alerts:
+            cols = st.columns([3, 1])
+            cols[0].write(f"{alert['kind']} {alert['note']} {alert['threshold']:,.4f}")
+            if cols[1].button("X", key=f"remove_alert_{alert['id']}"):
+                engine.remove(alert['id'])
+                save_alerts(engine)
+                st.rerun()
+    
+    # Số liệu thời gian từng giai đoạn
+    with st.sidebar.expander("Metrics"):
+        metrics_rows = snapshot()
+        if metrics_rows:
+            st.dataframe(pd.DataFrame(metrics_rows), hide_index=True)
+        else:
+            st.write("Chưa có số liệu")
+    
+    # Chế độ biểu đồ
+    chart_mode = st.sidebar.radio("Biểu đồ", ["Tương tác", "Ảnh PNG"], key="chart_mode")
+    interactive_chart = chart_mode == "Tương tác"
+    # Gửi Telegram là tùy chọn: phải vẽ ảnh PNG và chờ Gemini tới deadline
+    send_telegram = st.sidebar.checkbox("Gửi Telegram khi phân tích", value=False, key="send_telegram")
+    
+    # Profile lần chạy (cProfile + tracemalloc)
+    profile_enabled = st.sidebar.checkbox("Profile lần chạy", value=profiling.PROFILE_ENABLED, key="profile_toggle")
+    
     # Lưu coin và ngày
     st.session_state.selected_coin = coin
     st.session_state.days = days
@@ -93,8 +185,13 @@ def ui():
         st.session_state.last_analysis_time = datetime.now()
         
         with st.spinner("Đang phân tích..."):
-            result = analyze_crypto(coin, days=days)
+            result, profile_info = profiling.profile_run(analyze_crypto, coin, days=days, render_chart=not interactive_chart,
+                                                         send_telegram=send_telegram, enabled=profile_enabled,
+                                                         tag=f"{coin}_{days}d")
             crypto_data, fib_levels, signal_output, message, chart_path = result
+            export_prometheus()
+            if profile_enabled:
+                show_profile_status(profile_info)
             
             if crypto_data is None or crypto_data.empty:
                 st.error(f"Không thể phân tích {coin}. Không có dữ liệu hoặc lỗi API.")
@@ -103,36 +200,40 @@ def ui():
             
             st.session_state.analysis_result = result
             st.session_state.chart_path = chart_path
+            st.session_state.analyzed_coin = coin
             
             st.write(signal_output, unsafe_allow_html=True)
-            if chart_path and os.path.exists(chart_path):
-                st.image(chart_path, caption=f"{coin} Chart")
-            else:
-                st.warning(f"Không tìm thấy biểu đồ cho {coin}. Kiểm tra log để biết thêm chi tiết.")
-                logging.warning(f"No chart at {chart_path}")
+            show_chart(result, coin, interactive_chart)
     
     # Hiển thị kết quả nếu đã phân tích
     if st.session_state.get('analysis_result'):
+        # Thay chiến lược theo luật bằng phản hồi Gemini nếu đã về trước deadline
+        upgraded = upgrade_recommendation(st.session_state.get('analyzed_coin', coin))
+        if upgraded:
+            result = list(st.session_state.analysis_result)
+            result[2] = result[2].split("\n### AI Strategy\n")[0] + upgraded
+            st.session_state.analysis_result = tuple(result)
         st.write(st.session_state.analysis_result[2], unsafe_allow_html=True)
-        chart_path = st.session_state.get('chart_path')
-        if chart_path and os.path.exists(chart_path):
-            st.image(chart_path, caption=f"{st.session_state.selected_coin} Chart")
-        else:
-            st.warning(f"Không tìm thấy biểu đồ cho {st.session_state.selected_coin}. Kiểm tra log để biết thêm chi tiết.")
-            logging.warning(f"No chart at {chart_path}")
+        show_chart(st.session_state.analysis_result, st.session_state.selected_coin,
+                   interactive_chart or not st.session_state.analysis_result[4])
     
     # Backtest
+    mc_paths = st.number_input("Số đường Monte Carlo (0 = tắt)", value=10000, min_value=0, step=1000, key="mc_paths")
     if st.button("Run Backtest", key="run_backtest"):
         if st.session_state.get('analysis_result') and st.session_state.analysis_result[0] is not None:
             crypto_data = st.session_state.analysis_result[0]
             logging.info(f"Running backtest with columns: {crypto_data.columns.tolist()}")
-            backtest_result = run_backtest(crypto_data)
+            backtest_result, profile_info = profiling.profile_run(run_backtest, crypto_data, enabled=profile_enabled,
+                                                                  tag=f"backtest_{coin}_{days}d")
+            if profile_enabled:
+                show_profile_status(profile_info)
             if backtest_result:
                 st.subheader("Backtest Results")
                 st.write(f"Total Profit: ${backtest_result['total_profit']:,.2f}")
                 st.write(f"Number of Trades: {backtest_result['num_trades']}")
                 st.write(f"Win Rate: {backtest_result['win_rate']:.2f}%")
                 st.write(f"Final Balance: ${backtest_result['final_balance']:,.2f}")
+                show_monte_carlo(backtest_result, mc_paths)
                 logging.info("Backtest displayed")
             else:
                 st.error("Backtest failed")
@@ -141,6 +242,103 @@ def ui():
             st.error("No data to backtest. Run analysis first.")
             logging.error("No backtest data")
     
+    # Tương quan và chế độ biến động của watchlist
+    with st.expander("Tổng quan thị trường"):
+        market_coins = st.multiselect("Coins", coins, default=coins, key="market_coins")
+        monitor = get_monitor(market_coins) if len(market_coins) > 1 else None
+        if monitor and st.button("Cập nhật thị trường", key="refresh_market"):
+            with st.spinner("Đang cập nhật..."):
+                refresh_monitor(market_coins, days=days, monitor=monitor)
+        if monitor and monitor.ready:
+            st.write(f"{monitor.corr.count} bar, cập nhật tới {monitor.last_ts}")
+            st.dataframe(monitor.correlation().style.background_gradient(cmap="RdYlGn", vmin=-1, vmax=1).format("{:.2f}"))
+            st.dataframe(monitor.volatility().style.format({'short_vol': "{:.2f}%", 'long_vol': "{:.2f}%", 'ratio': "{:.2f}"}))
+        elif len(market_coins) < 2:
+            st.write("Chọn ít nhất 2 coin")
+    
+    # Lịch sử tín hiệu đã lưu
+    with st.expander("Lịch sử tín hiệu"):
+        history_signal = st.selectbox("Tín hiệu", ["Long", "Short", "Hold", "Tất cả"], key="history_signal")
+        history_days = st.number_input("Số ngày gần nhất", value=90, min_value=1, key="history_days")
+        since = pd.Timestamp.now() - pd.Timedelta(days=int(history_days))
+        history = query_signals(coin, None if history_signal == "Tất cả" else history_signal, since=since)
+        st.write(f"{len(history)} tín hiệu {coin}")
+        st.dataframe(history)
+        st.write("Độ chính xác tín hiệu (bar kế tiếp đi đúng hướng):")
+        st.dataframe(signal_accuracy(since=since), hide_index=True)
+        st.write("Các lần phân tích gần nhất:")
+        st.dataframe(recent_runs(coin, limit=20), hide_index=True)
+    
+    # Backtest danh mục trên toàn bộ watchlist
+    with st.expander("Portfolio Backtest"):
+        portfolio_coins = st.multiselect("Coins", coins, default=coins, key="portfolio_coins")
+        weighting = st.selectbox("Phân bổ vốn", WEIGHTINGS, key="portfolio_weighting")
+        fee = st.number_input("Phí giao dịch (%)", value=0.1, min_value=0.0, step=0.05, key="portfolio_fee") / 100
+        slippage = st.number_input("Trượt giá (%)", value=0.05, min_value=0.0, step=0.05, key="portfolio_slippage") / 100
+        if st.button("Run Portfolio Backtest", key="run_portfolio_backtest"):
+            frames = {}
+            with st.spinner("Đang tải dữ liệu..."):
+                for portfolio_coin in portfolio_coins:
+                    coin_data = fetch_crypto_data(portfolio_coin, days=days)
+                    if coin_data.empty:
+                        st.warning(f"Bỏ qua {portfolio_coin}: không có dữ liệu")
+                        continue
+                    coin_data = calculate_indicators(coin_data, SIGNAL_INDICATORS)
+                    frames[portfolio_coin] = compute_signals(coin_data, calculate_fibonacci_levels(coin_data))
+            if frames:
+                prices, signals = build_panels(frames)
+                portfolio_result = run_portfolio_backtest(prices, signals, weighting=weighting, fee=fee, slippage=slippage)
+            else:
+                portfolio_result = None
+            if portfolio_result:
+                st.write(f"Total Profit: ${portfolio_result['total_profit']:,.2f}")
+                st.write(f"Final Balance: ${portfolio_result['final_balance']:,.2f}")
+                st.write(f"Max Drawdown: {portfolio_result['max_drawdown'] * 100:.2f}%")
+                st.write(f"Phí + trượt giá: ${portfolio_result['total_costs']:,.2f}")
+                st.line_chart(portfolio_result['equity'])
+                st.dataframe(portfolio_result['attribution'])
+            else:
+                st.error("Portfolio backtest failed")
+    
+    # Backtest trên dữ liệu lịch sử trong archive
+    archived_coins = list_archived_coins()
+    if archived_coins:
+        with st.expander("Backtest từ archive"):
+            archive_coin = st.selectbox("Coin", archived_coins, key="archive_coin")
+            reader = open_archive(archive_coin)
+            if reader is None:
+                st.error(f"Không đọc được archive {archive_coin}")
+            else:
+                st.write(f"{len(reader)} bars: {reader.meta['start']} → {reader.meta['end']}")
+                start_date = st.date_input("Từ ngày", value=pd.Timestamp(reader.meta['start']).date(), key="archive_start")
+                end_date = st.date_input("Đến ngày", value=pd.Timestamp(reader.meta['end']).date(), key="archive_end")
+                if st.button("Run Archive Backtest", key="run_archive_backtest"):
+                    history = reader.frame(start_date, pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(1))
+                    if len(history) < 5:
+                        st.error("Không đủ dữ liệu trong khoảng đã chọn")
+                    else:
+                        history = calculate_indicators(history, SIGNAL_INDICATORS)
+                        history = compute_signals(history, calculate_fibonacci_levels(history))
+                        backtest_result, profile_info = profiling.profile_run(run_backtest, history, enabled=profile_enabled,
+                                                                              tag=f"backtest_archive_{archive_coin}")
+                        if profile_enabled:
+                            show_profile_status(profile_info)
+                        if backtest_result:
+                            st.write(f"Total Profit: ${backtest_result['total_profit']:,.2f}")
+                            st.write(f"Number of Trades: {backtest_result['num_trades']}")
+                            st.write(f"Win Rate: {backtest_result['win_rate']:.2f}%")
+                            st.write(f"Final Balance: ${backtest_result['final_balance']:,.2f}")
+                            show_monte_carlo(backtest_result, mc_paths)
+                        else:
+                            st.error("Backtest failed")
+    
+    # Hotspot của lần profile gần nhất
+    if st.session_state.get('last_profile'):
+        last_profile = st.session_state.last_profile
+        with st.expander(f"Profile: {last_profile['tag']}"):
+            st.write(f"File: {last_profile['path']}.prof, Peak bộ nhớ: {last_profile['peak_mb']} MB")
+            st.dataframe(pd.DataFrame(last_profile['hotspots']), hide_index=True)
+    
     # Test Telegram
     if st.button("Test Telegram", key="test_telegram"):
         try: